@@ -21,24 +21,17 @@ Destroying a rock in a stack moves all rocks & bots
 down one elevation level in the stack.'''
 
 import numpy as np
+import bisect
+import os
 import random
-import pdb
-from communicator import Communicator
-
-replay = 0
-try:
-    import matplotlib.pyplot as plt
-    from matplotlib import animation
-    from distutils.spawn import find_executable
-    if find_executable('convert') is None:  #check for ImageMagick install
-        replay = -1
-        raise ImportError
-    replay = True
-except ImportError:
-    import warnings
-    warnings.warn('Replay not supported: ' + ['matplotlib not found',
-                                              'ImageMagick not found'][replay],
-                  RuntimeWarning)
+import shutil
+import tempfile
+import time
+import trajectory
+from communicator import Communicator, PythonBot, BotTimeout, debug, WINDOWS
+from history import History
+#(render and buildcache are only imported when they're needed, which
+#keeps starting up - in every worker process, too - cheap)
 
 
 LEGEND = {'bound': '#',
@@ -56,12 +49,38 @@ ADDBOT = {'.':'b', '&':'B', '@':'@'}
 ADDSELF = {'.':'s', '&':'S', '@':'@'}
 ADDENEMY = {'.':'e', '&':'E', '@':'@'}
 
-COLOR = {'.': [0.95, 0.95, 0.95],
-         '&': [0.2, 0.2, 0.2],
-         'b': [0., 1., 0.],
-         'B': [0.2, 0.6, 0.6],
-         '@': [1., 0., 0.],
-         '#': [0., 0., 0.]}
+#the board itself is a uint8 grid of bit flags; characters only get
+#made when somebody wants to look at it.
+ROCK, BOT, SELF, METEOR, BOUND = 1, 2, 4, 8, 16
+SOLID = ROCK | BOT #what projectiles hit
+NOT_ROCK = np.uint8(0xff ^ ROCK)
+NOT_BOT = np.uint8(0xff ^ BOT)
+NOT_METEOR = np.uint8(0xff ^ METEOR)
+
+def _glyph_table(bot, botrock, me, merock):
+    '''map every flag combination to the character that shows it.'''
+    table = np.empty(32, dtype=np.uint8)
+    for code in xrange(32):
+        if code & BOUND:
+            char = LEGEND['bound']
+        elif code & METEOR:
+            char = LEGEND['meteor']
+        elif code & BOT:
+            char = [[bot, botrock], [me, merock]][bool(code & SELF)][code & ROCK]
+        else:
+            char = [LEGEND['air'], LEGEND['rock']][code & ROCK]
+        table[code] = ord(char)
+    return table
+
+GLYPHS = _glyph_table(LEGEND['bot'], LEGEND['botrock'], 
+                      LEGEND['bot'], LEGEND['botrock'])
+VIEW_GLYPHS = _glyph_table(LEGEND['enemy'], LEGEND['enemyrock'],
+                           LEGEND['self'], LEGEND['selfrock'])
+NEWLINE = ord('\n')
+#a binary view (see Board.view_binary) starts with these, as little-endian
+#int32s
+VIEW_HEADER = ['x', 'y', 'col', 'row', 'left', 'top', 'width', 'height']
+HEADER_SIZE = 4 * len(VIEW_HEADER)
 
 class Bot(object):
     '''the controller-side implementation for a bot (with the bot-side
@@ -71,13 +90,20 @@ class Bot(object):
             'left': (-1, 0),
             'right': (1, 0)}
 
-    def __init__(self, logic=None, x=0):
-        '''logic is a Communicator'''
+    def __init__(self, logic=None, x=0, board=None, index=0):
+        '''logic is a Communicator; board (if any) is the Board
+        keeping track of where we are, and index our place in its
+        list of bots.'''
         self.logic = logic
         self.name = logic.name
         self.location = x
         self.elevation = 0
         self._dead = False
+        self.latency = []
+        self.index = index
+        self._board = board
+        if board is not None:
+            board._place(self)
 
     @property
     def coords(self):
@@ -91,7 +117,11 @@ class Bot(object):
                     len(value) == 2,
                     all(isinstance(_, int) for _ in value)]):
             raise ValueError('value must be a list of 2 integers')
+        if self._board is not None:
+            self._board._unplace(self)
         self.location, self.elevation = value
+        if self._board is not None:
+            self._board._place(self)
 
     @property
     def dead(self):
@@ -100,12 +130,18 @@ class Bot(object):
 
     def kill(self):
         '''suicide, or murder, whatever.'''
+        if self._board is not None:
+            self._board._unplace(self)
         self._dead = True
 
     def _shift(self, dx, dy):
         '''shift position'''
+        if self._board is not None:
+            self._board._unplace(self)
         self.location += dx
         self.elevation += dy
+        if self._board is not None:
+            self._board._place(self)
 
     def _fall(self, distance):
         '''fall a distance, testing for death'''
@@ -129,6 +165,10 @@ class Bot(object):
         '''literally do nothing'''
         pass
 
+    def forfeit(self, board, *arg):
+        '''out of time, and out of luck.'''
+        self.kill()
+
     def throw(self, board, direction='down', distance=None, *arg):
         '''throw a rock a distance (in x); if no distance given,
         or if distance > elevation, use elevation. distance=0
@@ -147,14 +187,7 @@ class Bot(object):
             return
         dy = float(self.elevation) / float(distance) if distance > 0 else 1
         dx = self.dirs[direction][0]
-        x = x + dx
-        b = board.find_bot(x, y)
-        #if b != None:
-        #    pdb.set_trace()
-        while not board.collide(x, y):
-            x, y = x + dx, int(y - dy)
-        if b != None and not b.dead:
-            pdb.set_trace()
+        board.throw_rock(x + dx, y, dx, dy)
 
     def drop(self, board, direction='down', *arg):
         '''drop a rock. dropping 'down' puts the rock in your space
@@ -165,7 +198,7 @@ class Bot(object):
         direction = direction.lower()
         x, y = self.coords
         if direction == 'down':
-            if 'rock' in board(x, y):
+            if board.is_rock(x, y):
                 return
             board.place_rock(x, y)
         else:
@@ -179,65 +212,163 @@ class Bot(object):
 
     def __call__(self, board):
         '''send the input to the bot code via the Communicator,
-        and parse the output for syntactic validity.'''
-        view = board.view(*self.coords)
-        output = self.logic(view)
+        and parse the output for syntactic validity. (a logic with a
+        look method picks how it sees the board; otherwise it gets the
+        view string.)'''
+        begin = time.time()
+        look = getattr(self.logic, 'look', None)
+        view = look(board, *self.coords) if look else board.view(*self.coords)
+        start = time.time()
+        try:
+            output = self.logic(view)
+            move = None
+        except BotTimeout:
+            move = ('forfeit', None, None) if self.logic.forfeit else None
+            output = 'rest'
+        finally:
+            end = time.time()
+            self.latency.append(end - start)
+        move = move or self.parse(output)
+        if board.stats is not None:
+            board.stats.bot(self.name, start - begin, end - start,
+                            time.time() - end)
+        return move
+
+    def parse(self, output):
+        '''turn a bot's output into an (action, direction, distance)'''
         #time to parse the donuts
         output = output.lower().split()
         direction = distance = None
-        action = output[0]
+        action = output[0] if output else 'rest'
         if action not in ['rest','move','drop','throw']:
             action = 'rest'
         if len(output) > 1:
             direction = output[1]
             if direction not in self.dirs.keys():
                 action = 'rest'
-        try:
-            distance = int(output[2])
+        try: #(kept to 32 bits, so it can go in a replay file)
+            distance = max(-2 ** 31 + 1, min(int(output[2]), 2 ** 31 - 1))
         except IndexError:
             pass
         except ValueError:
             action = 'rest'
+        if action == 'rest':
+            return 'rest', None, None
         return action, direction, distance
 
+class Recorded(object):
+    '''stands in for a bot's Communicator, playing back the moves it
+    made in a recorded game (in order, one per turn it was alive).'''
+    forfeit = True
+
+    def __init__(self, name, moves):
+        self.name = name
+        self._moves = iter(moves)
+
+    def __call__(self, view):
+        action, direction, distance = next(self._moves)
+        if action == 'forfeit':
+            raise BotTimeout(self.name)
+        return ' '.join(str(_) for _ in (action, direction, distance)
+                        if _ is not None)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
 class Meteor(object):
     '''a quick & dirty meteor, which falls from a random point at
-    the top of the board at a speed of 2/step, at a random angle.'''
-    def __init__(self):
-        from itertools import count
-        from math import sin, cos, radians
-        r, theta = 2, radians(random.randrange(-180,0))
-        self._xpar = count(random.randrange(100), r * cos(theta))
-        self._ypar = count(99, r * sin(theta))
+    the top of the board at a speed of 2/step, at a random angle.
+    rng is where the randomness comes from (the game's own generator).
+    where it set off and at what angle (self.spawn) pin down its whole
+    path.'''
+    def __init__(self, width=100, height=100, rng=random):
+        angle = rng.randrange(-180,0)
+        self.spawn = rng.randrange(width), height - 1, angle
+        #it's off the board well before it could run out of path
+        steps = max(width, height) + 2
+        xs, ys = trajectory.fall_path(*(self.spawn + (steps,)))
+        self._path = zip(xs[:steps].tolist(), ys[:steps].tolist())
+        self._step = -1
         self.x = self.y = None
         self.destroy = False
     
     @property
     def coords(self):
-        return int(self.x), int(self.y)
+        return self.x, self.y
     
     def step(self):
-        '''we're using count()s as our parametric equations'''
-        self.x = next(self._xpar)
-        self.y = next(self._ypar)
+        '''the whole path is worked out in advance; just move along it'''
+        self._step += 1
+        self.x, self.y = self._path[self._step]
 
 
 class Board(object):
     '''The game itself'''
-    def __init__(self, bot_list, mode='free-for-all', max_turns = 500):
+    def __init__(self, bot_list, mode='free-for-all', max_turns = 500,
+                 concurrent = True, record = None, width = 100, 
+                 height = 100, seed = None, profile = False):
+        '''record is a filename to stream a replay of the game to.
+        everything random in the game comes from its own generator,
+        seeded with seed (a fresh one is picked if it's None), so a game
+        with the same seed and the same moves always plays out the same
+        way. with profile, self.stats keeps track of where the time
+        goes (see profiling.py); otherwise it's None.'''
         self._botlist = bot_list
-        self._board = np.full((100,100),'.',dtype='string_')
-        bot_initial_positions = random.sample(xrange(100), len(self._botlist))
-        self._bots = [Bot(logic=b, x=bot_initial_positions[i]) for i, b 
-                      in enumerate(self._botlist)]
+        self.stats = None
+        if profile:
+            from profiling import Stats, COUNTED
+            self.stats = Stats()
+            self.stats.games = 1
+            for name in COUNTED:
+                setattr(self, name, self.stats.counted(name, 
+                                                       getattr(self, name)))
+        self.seed = random.randrange(2 ** 31) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.concurrent = concurrent
+        self._pool = None
+        self.width, self.height = width, height
+        #the board lives inside its border, and everything that changes
+        #it writes straight through, so views never need a fresh copy.
+        #meteors are flagged on it too (projectiles only hit SOLID).
+        self._frame = np.full((height + 2, width + 2), BOUND, dtype=np.uint8)
+        self._frame[1:-1, 1:-1] = 0
+        self._board = self._frame[1:-1, 1:-1]
+        self._dirty = set()
+        self._columns = [[] for _ in xrange(width)] #rock heights, per column
+        bot_initial_positions = self.rng.sample(xrange(width), 
+                                                len(self._botlist))
+        self._occupancy = {}
+        self._bots = [Bot(logic=b, x=bot_initial_positions[i], board=self,
+                          index=i) for i, b in enumerate(self._botlist)]
         self._meteors = []
         self.deathturn = []
         self._turn = 0
-        self.history = []
+        self.history = History(seed=self.seed)
+        self._replay = None
+        if record is not None:
+            from replayfile import ReplayWriter
+            self._replay = ReplayWriter(record, [b.name for b in bot_list],
+                                        width, height, keyframe_every = 
+                                            self.history.keyframe_every,
+                                        seed = self.seed)
         self.save_snapshot()
         self.max_turns = max_turns - 1
         self.done = False
 
+    def __getstate__(self):
+        '''the counting wrappers a profiled game puts over its methods
+        don't pickle (e.g. coming back from a worker process); the counts
+        are kept in self.stats anyway.'''
+        state = self.__dict__.copy()
+        if self.stats is not None:
+            from profiling import COUNTED
+            for name in COUNTED:
+                del state[name]
+        return state
+
     @property
     def bot_pos(self):
         '''a list of bot positions'''
@@ -250,36 +381,54 @@ class Board(object):
 
     def __call__(self, x, y):
         '''this gets the description of the thing, not the character,
-        which is accessible from self._board'''
-        if self.find_bot(x, y) != None:
-            return LOOKUP[ADDBOT[self._board[y,x]]]
-        return LOOKUP[self._board[y, x]]
+        or the flags, which are in self._board'''
+        return LOOKUP[chr(GLYPHS[self._board[y, x] & SOLID])]
 
     def __repr__(self):
         '''generate a bot-neutral string representation of the board'''
-        board = self._board.copy()
-        nrow, ncol = board.shape
-        for x, y in self.bot_pos:
-            if not self.find_bot(x, y).dead:
-                board[y, x] = ADDBOT[board[y, x]]
-        for m in self._meteors:
-            x, y = m.coords
-            board[y, x] = LEGEND['meteor']
-        rows = ['#%s#' % ''.join(board[row].tolist()) for row in 
-                reversed(xrange(nrow))]
-        rows = ['#' * (ncol + 2)] + rows + ['#' * (ncol + 2)]
-        return '\n'.join(rows)
+        return self.build_string(GLYPHS[self.frame()])
+
+    def is_rock(self, x, y):
+        '''is there a rock here?'''
+        return bool(self._board[y, x] & ROCK)
+
+    def frame(self):
+        '''a copy of the board's flags with the border around it, and
+        the meteors in.'''
+        return self._frame.copy()
 
     def find_bot(self, x, y):
-        '''locate a bot or return None if it ain't there.'''
-        for bot in self._bots:
-            if bot.location == x and bot.elevation == y and not bot.dead:
-                return bot
-        return None
+        '''locate a bot or return None if it ain't there. if several
+        living bots share the square, the first in the list wins.'''
+        cell = self._occupancy.get((x, y))
+        return cell[0] if cell else None
+
+    def _place(self, bot):
+        '''add a living bot to the occupancy index, keeping each
+        square's bots in list order.'''
+        if bot.dead:
+            return
+        cell = self._occupancy.setdefault((bot.location, bot.elevation), [])
+        if not cell:
+            self._board[bot.elevation, bot.location] |= BOT
+        i = len(cell)
+        while i > 0 and cell[i - 1].index > bot.index:
+            i -= 1
+        cell.insert(i, bot)
+
+    def _unplace(self, bot):
+        '''drop a bot from the occupancy index (when it moves or dies).'''
+        key = (bot.location, bot.elevation)
+        cell = self._occupancy.get(key)
+        if cell and bot in cell:
+            cell.remove(bot)
+            if not cell:
+                del self._occupancy[key]
+                self._board[bot.elevation, bot.location] &= NOT_BOT
     
     def boundary(self, x, y):
         '''are we off the edge of the board?'''
-        return x < 0 or x > 99 or y < 0 or y > 99
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
         #return self._board[y, x] == '#'
 
     def collide(self, x, y):
@@ -288,81 +437,168 @@ class Board(object):
         or a bot, the target is destroyed; any rocks or bots supported
         by the destroyed target fall 1 square (we hope, this part isn't
         working yet...)'''
-        if any([_ < 0 or _ > 99 for _ in [x, y]]):
+        if self.boundary(x, y):
             return True
-        has = self(x, y)
-        if has == 'air':
+        has = self._board[y, x] & SOLID
+        if not has: #air
             return False
-        elif has == 'bound':
-            return True
         else: #we're gonna destroy one or more things
             self.crush(x, y)
-            column = [(ele, self(x, ele)) for ele in range(100)] #grab the whole column
-            rocks = [ele for ele, _ in column if 'rock' in _]
-            bots = [ele for loc, ele in self.bot_pos if loc == x]
+            rocks = self._columns[x] #the whole column's rocks
+            bots = [b for b in self._bots if b.location == x and not b.dead]
             nrock = max([len(rocks) - 1,0]) #we just destroyed one, maybe
-            toprock = max(rocks) if len(rocks) > 0 else 0
-            self._board[:,x] = '.'
-            self._board[:nrock, x] = '&'
+            toprock = rocks[-1] if len(rocks) > 0 else 0
+            settled = range(nrock)
+            for ele in set(rocks).symmetric_difference(settled):
+                self._board[ele, x] ^= ROCK
+                self._dirty.add((x, ele))
+            self._columns[x] = settled
             for bot in bots:
-                if bot < y:
+                if bot.elevation < y or bot.dead:
                     continue
-                if bot < toprock:
-                    self.crush(x, bot)
+                if bot.elevation < toprock:
+                    bot.kill()
                 else:
-                    b = self.find_bot(x, bot)
-                    if b is not None:
-                        b._fall(1)
+                    bot._fall(1)
             return True
 
+    def throw_rock(self, x, y, dx, dy):
+        '''a rock thrown from (x, y) moves dx across and drops dy each
+        step, until it hits something or leaves the board.'''
+        nrow, ncol = self._board.shape
+        xs, ys = trajectory.throw_path(x, y, dx, dy, ncol, nrow)
+        hit = trajectory.first_hit(self._board, xs, ys, SOLID)
+        return self.collide(int(xs[hit]), int(ys[hit]))
+
     def crush(self, x, y):
-        '''kill a bot in this square, if any'''
-        bot = self.find_bot(x, y)
-        if bot is not None:
+        '''kill any bots in this square. (there can be more than one
+        partway through a turn; sparing all but the first let the rest
+        fall through the floor.)'''
+        for bot in list(self._occupancy.get((x, y), ())):
             bot.kill()
 
     def fall_distance(self, x, y):
-        '''how far do we have to fall to get to a supported space?'''
-        fall = 0
-        y0 = lambda t: y - t - 1
-        test = lambda s: s not in ('bound', 'rock') and s >= 0 and s <= 99
-        while test(self(x, y0(fall))):
-            fall += 1
-        return fall
+        '''how far do we have to fall to get to a supported space?
+        (nothing falls: the original check compared the square against
+        numbers, which never holds under python 2, and the game has
+        always been played that way. making things fall would be a
+        change to the rules.)'''
+        return 0
 
     def place_rock(self, x, y):
         '''put a rock here.'''
-        self._board[y, x] = '&'            
+        if not self._board[y, x] & ROCK:
+            bisect.insort(self._columns[x], y)
+        self._board[y, x] |= ROCK
+        self._dirty.add((x, y))
     
     @staticmethod
     def build_string(b):
-        nrow, ncol = b.shape
-        return '\n'.join([''.join(b[row].tolist()) 
-                            for row in reversed(xrange(nrow))])
+        '''turn an array of character codes into lines of text, 
+        top row first.'''
+        return '\n'.join([row.tostring() for row in b[::-1]])
 
     def view(self, x0, y0):
         '''put together a view string to pass to a bot.
         max view distance is 20 squares in any direction (chebyshev).
-        we must account for the border as well.'''
-        lx, hx, ly, hy = np.clip([x0 - 19, x0 + 21, y0 - 19, y0 + 21], 0, 101)
-        board = np.full((102, 102),'#',dtype='string_')
-        board[1:101, 1:101] = self._board
-        for x, y in self.bot_pos:
-            board[y + 1, x + 1] = ADDSELF[board[y + 1, x + 1]] \
-                                  if (x, y) == (x0, y0) else \
-                                  ADDENEMY[board[y + 1, x + 1]]
-        for m in self._meteors:
-            x, y = m.coords
-            board[y + 1, x + 1] = LEGEND['meteor']
-        b = board[ly:hy + 1, lx:hx + 1]
-        return self.build_string(b)
+        we must account for the border as well. only the window itself
+        is looked at, however big the board is.'''
+        rows = self._window(x0, y0, 1)
+        rows[:, -1] = NEWLINE
+        return rows.tostring()[:-1]
+
+    def view_array(self, x0, y0):
+        '''the same view as an array of characters (dtype 'S1'), top
+        row first, for bots which would rather not parse a string.'''
+        return self._window(x0, y0).view('S1')
+
+    def view_binary(self, x0, y0):
+        '''the view as a uint8 array, ready to send: a header (see
+        VIEW_HEADER) and then the cells, one byte (character) each, top
+        row first. x, y is where the bot is on the board, col, row where
+        it is in the view (counting rows downwards), and left, top the
+        board column and row of the view's top left cell.'''
+        lx, hx, ly, hy = self._bounds(x0, y0)
+        width, height = hx - lx + 1, hy - ly + 1
+        out = np.empty(HEADER_SIZE + width * height, dtype=np.uint8)
+        out[:HEADER_SIZE].view('<i4')[:] = [x0, y0, x0 + 1 - lx,
+                                            hy - 1 - y0, lx - 1, hy - 1,
+                                            width, height]
+        out[HEADER_SIZE:].reshape(height, width)[...] = self._window(x0, y0)
+        return out
+
+    def view_window(self, x0, y0):
+        '''the view as (left, top, codes): the array of character codes
+        (uint8, top row first) and where its top left corner is, as a
+        column and a row counted downwards (that's minus the height),
+        so that two windows can be lined up with each other.'''
+        lx, hx, ly, hy = self._bounds(x0, y0)
+        return lx, -hy, self._window(x0, y0)
+
+    def _bounds(self, x0, y0):
+        '''the columns and rows (of the bordered frame) a bot at (x0, y0)
+        can see: lx, hx, ly, hy.'''
+        return np.clip([x0 - 19, x0 + 21, y0 - 19, y0 + 21], 0, 
+                       [self.width + 1] * 2 + [self.height + 1] * 2)
+
+    def _window(self, x0, y0, pad=0):
+        '''the character codes a bot at (x0, y0) can see, top row first,
+        with pad spare columns on the right.'''
+        lx, hx, ly, hy = self._bounds(x0, y0)
+        codes = self._frame
+        rows = np.empty((hy - ly + 1, hx - lx + 1 + pad), dtype=np.uint8)
+        rows[:, :hx - lx + 1] = VIEW_GLYPHS[codes[hy:ly - 1 if ly else None:-1,
+                                                  lx:hx + 1]]
+        rows[hy - y0 - 1, x0 + 1 - lx] = VIEW_GLYPHS[codes[y0 + 1, x0 + 1]
+                                                     | SELF]
+        return rows
     
+    def play(self):
+        '''run the game to completion, keeping any persistent bot
+        processes alive for its duration. in concurrent mode the bots
+        are queried from a thread pool, one thread per bot (in-process
+        bots gain nothing from threads, so a field of only those
+        doesn't get one).'''
+        waiting = [logic for logic in self._botlist 
+                   if not getattr(logic, 'inprocess', False)]
+        if self.concurrent and len(waiting) > 1:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(len(self._bots))
+        for logic in self._botlist:
+            logic.start()
+        try:
+            while not self.done:
+                self.step()
+                #print 'Turn %i, living bots: %s' % (self._turn, 
+                #            ', '.join([b.logic.name for b in self._bots]))
+        finally:
+            for logic in self._botlist:
+                logic.stop()
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def decide(self):
+        '''ask every living bot for its action. every bot sees the same
+        pre-turn board, so the queries can all be in flight at once;
+        the results come back in bot order either way.'''
+        query = lambda bot: bot(self)
+        if self._pool is None:
+            return map(query, self._bots)
+        return self._pool.map(query, self._bots, chunksize=1)
+
     def step(self):
-        '''priority: rests -> moves -> drops -> throws -> meteors
+        '''priority: forfeits -> rests -> moves -> drops -> throws -> meteors
         priority pt 2: low elevation -> high elevation'''
+        stats = self.stats #(phases are timed only when profiling)
+        if stats is not None: stats.start()
         self._turn += 1
-        actions = [[bot, bot.elevation, bot(self)] for bot in self._bots]
-        for act in ('rest', 'move', 'drop', 'throw'):
+        actions = [[bot, bot.elevation, act] for bot, act 
+                   in zip(self._bots, self.decide())]
+        played = {bot.index: act for bot, _, act in actions}
+        if stats is not None: stats.lap('decide')
+        for act in ('forfeit', 'rest', 'move', 'drop', 'throw'):
             these = sorted(filter(lambda b: b[2][0] == act, actions), 
                            key = lambda b: b[1])
             for bot in these:
@@ -370,83 +606,188 @@ class Board(object):
                     continue
                 f = getattr(bot[0], act)
                 f(self, *bot[2][1:])
-        #now we handle bot-bot collisions:
-        coords = [(bot, bot.coords) for bot in self._bots]
-        while len(coords) > 1:
-            b = coords.pop()
-            for i, c in enumerate(coords):
-                if b[1] == c[1]:
-                    b[0].kill()
-                    c[0].kill()
-                    del coords[i]
+            if stats is not None: stats.lap(act)
+        #now we handle bot-bot collisions: everyone sharing a square dies
+        squares = {}
+        for bot in self._bots:
+            squares.setdefault((bot.location, bot.elevation), []).append(bot)
+        for crowd in squares.itervalues():
+            if len(crowd) > 1:
+                for bot in crowd:
+                    bot.kill()
+        if stats is not None: stats.lap('collisions')
         #meteors time!
-        self._meteors.append(Meteor())
+        self._meteors.append(Meteor(self.width, self.height, self.rng))
         for i, m in enumerate(self._meteors):
+            if m.x is not None:
+                x, y = m.coords
+                self._board[y, x] &= NOT_METEOR
             m.step()
             m.destroy = self.collide(*m.coords)
         self._meteors = filter(lambda m: not m.destroy, self._meteors)
+        for m in self._meteors:
+            x, y = m.coords
+            self._board[y, x] |= METEOR
+        if stats is not None: stats.lap('meteors')
         #garbage collection
         self.deathturn.append([self._turn, 
                                filter(lambda b: b.dead, self._bots)])
         self._bots = filter(lambda b: not b.dead, self._bots)
-        self.save_snapshot()
+        if stats is not None: stats.lap('cleanup')
+        self.save_snapshot(played)
+        if stats is not None: stats.lap('snapshot')
         if self._turn >= self.max_turns:
             self.deathturn.append([self._turn + 1, self._bots])
             self.done = True
         else:
             self.done = len(self._bots) == 0
+        if self.done and self._replay is not None:
+            self._replay.close()
+            self._replay = None
         
-    def save_snapshot(self):
-        '''save a snapshot of the game board, for replays later'''
-        nrow, ncol = self._board.shape
-        record = {'bots': [tuple(_) for _ in self.bot_pos], 
-                  'rocks': [(loc, ele) for ele in xrange(nrow) 
-                            for loc in xrange(ncol) 
-                            if self._board[ele, loc] == LEGEND['rock']],
-                  'meteors': [tuple(m.coords) for m in self._meteors]}
-        self.history.append(record)
+    def save_snapshot(self, actions=None):
+        '''record what changed this turn (and the moves that did it) in
+        the game history, for replays later'''
+        changes = [(x, y, self.is_rock(x, y)) for x, y in sorted(self._dirty)]
+        self._dirty = set()
+        self.history.append(changes, 
+                            {bot.index: tuple(bot.coords) for bot in self._bots},
+                            [m.spawn + (m._step,) for m in self._meteors],
+                            actions)
+        if self._replay is not None:
+            self._replay.write(self.history.records[-1])
 
 class Controller(object):
     '''this loads the bots and runs the games.'''
-    def __init__(self, botdir):
+    def __init__(self, botdir, timeout=None, forfeit=False, width=100,
+                 height=100, seed=None, profile=False):
+        '''seed fixes the seeds of all the games, in order. botdir can
+        be None, for a field made up only of bots entered with
+        add_bot. with profile, self.stats adds up the profiling stats
+        of every game run.'''
         self.botdir = botdir
-        self.bot_names = Communicator.read_bot_list(botdir)
+        self.rng = random.Random(seed)
+        self.timeout = timeout
+        self.forfeit = forfeit
+        self.board_options = {'width': width, 'height': height,
+                              'profile': profile}
+        self.stats = None
+        if profile:
+            from profiling import Stats
+            self.stats = Stats()
+        self.bot_names = (Communicator.read_bot_list(botdir) 
+                          if botdir is not None else [])
         self.bots = []
         self.load_bots()
         
     def load_bots(self):
+        import buildcache
         bd = self.botdir
         for d in self.bot_names:
             with open(os.path.join(bd, d, "command.txt"), 'r') as f:
                 commands = f.read().splitlines()
             if commands:
-                for command in commands[0:-1]:
-                    subprocess.call(command.split(" "), 
-                                    cwd=os.path.join(bd, d))
+                if commands[0:-1]: #pre-run, if it hasn't been already
+                    buildcache.prepare(os.path.join(bd, d), commands[0:-1])
                 if WINDOWS:
                     commands[-1] = commands[-1].replace("./", 
                                                         os.path.join(bd, d)
                                                         + "/")
                 #no_print = os.path.isfile(botdir+d+"/noprint")
                 no_print = True
+                options = Communicator.read_options(os.path.join(bd, d))
+                if 'inprocess' in options:
+                    self.bots.append(PythonBot.load(d, commands[-1], bd,
+                                                    'array' in options))
+                    continue
                 self.bots.append(Communicator(bot_name=d, 
                                               command=commands[-1],
                                               no_print=no_print,
-                                              botdir = bd))
+                                              botdir = bd,
+                                              persistent = 'persistent' 
+                                                           in options,
+                                              timeout = self.timeout,
+                                              forfeit = self.forfeit,
+                                              state = 'state' in options,
+                                              diff = 'diff' in options,
+                                              binary = 'binary' in options))
         self.scores = {b:[] for b in self.bot_names}
-
-    def run(self, ngame=1):
-        '''run some number of games.'''
-        self.games = [Board(self.bots) for _ in xrange(ngame)]
+        self.latency = {b:[] for b in self.bot_names}
+
+    def add_bot(self, name, function, array=False):
+        '''enter an in-process bot: function takes the view (a string,
+        or with array a character array) and returns a move.'''
+        self.bots.append(PythonBot(name, function, array=array))
+        self.bot_names.append(name)
+        self.scores[name] = []
+        self.latency[name] = []
+
+    def run(self, ngame=1, jobs=1, record=None, fields=None):
+        '''run some number of games, spread over a pool of jobs
+        worker processes if jobs > 1. if record is a directory, each 
+        game's replay is streamed to a file in it as it's played.
+        every bot plays in every game, unless fields (a list with a list
+        of bot names for each game to play) says who plays in which.'''
+        if fields is None:
+            fields = [range(len(self.bots))] * ngame
+        else:
+            where = {bot.name: i for i, bot in enumerate(self.bots)}
+            fields = [[where[name] for name in field] for field in fields]
+        ngame = len(fields)
+        seeds = [self.rng.randrange(2 ** 31) for _ in xrange(ngame)]
+        if jobs > 1:
+            self.games = self._run_pool(fields, jobs, record, seeds)
+        else:
+            self.games = [Board([self.bots[j] for j in field], 
+                                record=replay_file(record, i, ngame),
+                                seed=seeds[i], **self.board_options) 
+                          for i, field in enumerate(fields)]
+            for game in self.games:
+                if debug: print 'Running the next game!'
+                game.play()
         for game in self.games:
-            if debug: print 'Running the next game!'
-            while not game.done:
-                game.step()
-                #print 'Turn %i, living bots: %s' % (game._turn, 
-                #                ', '.join([b.logic.name for b in game._bots]))
+            if self.stats is not None:
+                self.stats.merge(game.stats)
             for turn, dead in game.deathturn:
                 for bot in dead:
                     self.scores[bot.name].append(turn)
+                    self.latency[bot.name].extend(bot.latency)
+
+    def _run_pool(self, fields, jobs, record, seeds):
+        '''play the games in worker processes, each with a private copy
+        of the bot directories (so storage files don't collide). the
+        finished boards come back pickled; errlogs are merged back into
+        the real bot directories afterwards.'''
+        import multiprocessing
+        workroot = tempfile.mkdtemp()
+        try:
+            pool = multiprocessing.Pool(jobs, _init_worker, 
+                                        (self.bots, workroot))
+            try:
+                games = pool.map(_play_game, 
+                                 [(i, replay_file(record, i, len(fields)),
+                                   field,
+                                   dict(self.board_options, seed=seeds[i]))
+                                  for i, field in enumerate(fields)], 
+                                 chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            for workdir in os.listdir(workroot):
+                for bot in self.bots:
+                    if bot.cwd is None:
+                        continue
+                    log = os.path.join(workroot, workdir, bot.name, 
+                                       'errlog.txt')
+                    if not os.path.isfile(log):
+                        continue
+                    with open(log, 'r') as src:
+                        with open(os.path.join(bot.cwd, 'errlog.txt'),
+                                  'a') as dst:
+                            shutil.copyfileobj(src, dst)
+        finally:
+            shutil.rmtree(workroot, ignore_errors=True)
+        return games
 
     def leaderboard(self):
         '''accumulate all the bots' scores across all games
@@ -460,36 +801,115 @@ class Controller(object):
                                                     score_accum[bot]))
         return '\n'.join(rows)
     
+    def timings(self):
+        '''per-bot response times (in ms) across all games, slowest
+        bots first'''
+        stats = {}
+        for bot, lat in self.latency.items():
+            if lat:
+                stats[bot] = 1000 * np.percentile(lat, [50, 95, 100])
+        rows = ['{:20}    {:>8} {:>8} {:>8} {:>7}'.format('', 'p50', 'p95',
+                                                        'max', 'moves')]
+        for bot in sorted(stats, reverse=True, key=lambda x: stats[x][1]):
+            rows.append('{:20} -> {:6.1f}ms {:6.1f}ms {:6.1f}ms {:7d}'.format(
+                        bot, *(list(stats[bot]) + [len(self.latency[bot])])))
+        return '\n'.join(rows)
+    
     def save_replay(self, gid, filename='Abotalypse_Replay'):
-        '''use a matplotlib animation (output to webm) to show
-        a replay of a game's history.'''
-        if replay < 1:
-            return
-        history = self.games[gid].history
-        fig = plt.figure(figsize=(6, 6))
-        plt.axis('off')
-        blank = np.full((100,100,3), COLOR['.'])
-        im = plt.imshow(blank, interpolation='nearest')
-        def init():
-            im.set_array(blank)
-            return [im]
-        def animate(i):
-            turn = history[i]
-            img = np.full((100,100,3), COLOR['.'])
-            all_things = {xy:'&' for xy in turn['rocks']}
-            all_things.update({xy:'@' for xy in turn['meteors']})
-            all_things.update({xy:ADDBOT[all_things.get(xy,'.')] 
-                                for xy in turn['bots']})
-            for (x, y), char in all_things.items():
-                img[y, x] = COLOR[char]
-            img = img[::-1,...]
-            im.set_array(img)
-            return [im]
-        anim = animation.FuncAnimation(fig, animate, init_func=init,
-                                       frames=len(history), interval=20,
-                                       blit=True)
-        anim.save('replays/' + filename + '.webm', writer='ffmpeg',
-                  fps=30, extra_args=['-vcodec', 'libvpx'])
+        '''render a replay of a game's history: a webm if we have
+        ffmpeg, otherwise a folder of png frames.'''
+        import render
+        game = self.games[gid]
+        if render.ffmpeg() is not None:
+            filename += '.webm'
+        else:
+            import warnings
+            warnings.warn('ffmpeg not found: replays will be saved as png '
+                          'frames', RuntimeWarning)
+        render.save(game.history.records, os.path.join('replays', filename),
+                    game.width, game.height)
+
+def replay_file(record, gid, ngame):
+    '''where game #gid's replay goes, if we're recording to record'''
+    if record is None:
+        return None
+    return os.path.join(record, 'Abotcalypse_Replay_%i_of_%i.abr' 
+                                % (gid + 1, ngame))
+
+def rerun(history, names, width=100, height=100):
+    '''play a recorded game over again, from its seed and the moves the
+    bots made, checking that every turn comes out exactly as recorded.
+    returns the new Board; raises AssertionError at the first turn
+    which doesn't match.'''
+    from history import apply_record, meteor_positions
+    records = history.records
+    if history.seed is None:
+        raise ValueError('no seed was recorded for this game')
+    if len(records) > 1 and 'actions' not in records[1]:
+        raise ValueError('no moves were recorded for this game')
+    moves = [[] for _ in names]
+    for record in records[1:]:
+        for i, act in record['actions'].items():
+            moves[i].append(act)
+    #a game that wasn't wiped out ended by running out of turns
+    max_turns = len(records) + (not history.state_at(-1)[1])
+    game = Board([Recorded(n, m) for n, m in zip(names, moves)], 
+                 max_turns=max_turns, concurrent=False, width=width,
+                 height=height, seed=history.seed)
+    then, now = (set(), {}, []), (set(), {}, [])
+    for turn, record in enumerate(records):
+        if turn:
+            if game.done:
+                raise AssertionError('game over at turn %i, but the '
+                                     'recording goes on' % turn)
+            game.step()
+        then = apply_record(then, record)
+        now = apply_record(now, game.history.records[turn])
+        #(older replays only have the meteors' positions)
+        if (then[:2] != now[:2] or
+                meteor_positions(then[2]) != meteor_positions(now[2]) or
+                record.get('actions') != game.history.records[turn].get(
+                                                                'actions')):
+            raise AssertionError('turn %i differs from the recording' % turn)
+    if not game.done:
+        raise AssertionError('the recording ends at turn %i, but the game '
+                             'goes on' % (len(records) - 1))
+    return game
+
+def verify_replay(filename):
+    '''rerun the game in a replay file; returns how many turns matched.'''
+    from replayfile import ReplayReader
+    replay = ReplayReader(filename)
+    try:
+        rerun(replay.history, replay.names, replay.width, replay.height)
+        return len(replay) - 1
+    finally:
+        replay.close()
+
+DEFAULT_COPIES = '.default_bots' #where --default runs its bots from
+
+_worker_bots = []
+
+def _init_worker(bots, workroot):
+    '''pool initializer: move the bots into a private directory (less
+    their errlogs, so only what's logged here gets merged back).'''
+    workdir = tempfile.mkdtemp(dir=workroot)
+    for bot in bots:
+        if bot.cwd is None: #nothing on disk
+            continue
+        dst = os.path.join(workdir, bot.name)
+        shutil.copytree(bot.cwd, dst,
+                        ignore=shutil.ignore_patterns('errlog.txt'))
+        bot.cwd = dst
+    _worker_bots[:] = bots
+
+def _play_game(args):
+    '''play one full game in a worker process.'''
+    gid, record, field, options = args
+    if debug: print 'Running game #%i' % (gid + 1)
+    game = Board([_worker_bots[j] for j in field], record=record, **options)
+    game.play()
+    return game
 
 if __name__ == "__main__":
     import argparse
@@ -500,40 +920,64 @@ if __name__ == "__main__":
     parser.add_argument('-r', '--replay', action='store_true')
     parser.add_argument('botdir', nargs='?', default='bots/')
     parser.add_argument('--ndefault', type=int, default=2)
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs', default=1)
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('-t', '--timeout', type=float, default=None,
+                        help='per-move time budget, in seconds')
+    parser.add_argument('--record', metavar='DIR', default=None,
+                        help='stream a replay file of each game into DIR')
+    parser.add_argument('--forfeit', action='store_true',
+                        help='kill bots which run out of time '
+                             '(default: they just rest)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for the games (and the --default picks)')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the phases of every turn, and report')
+    parser.add_argument('--verify', metavar='FILE', default=None,
+                        help='replay the game in a replay file from its '
+                             'recorded moves, checking every turn')
     
     args = parser.parse_args()
+    if args.verify:
+        print '{}: {:d} turns match'.format(args.verify,
+                                            verify_replay(args.verify))
+        raise SystemExit
     botdir = 'default_bots/' if args.default else args.botdir
     ng = args.ngame
     print 'Playing {:d} games, with bots from the folder: {}'.format(ng,botdir)
     if args.default:
-        import tempfile, shutil
         available = [x for x in os.listdir(botdir) 
                      if os.path.isdir(os.path.join(botdir, x))]
-        bot_names = [random.choice(available) 
+        picker = random.Random(args.seed)
+        bot_names = [picker.choice(available) 
                      for _ in xrange(args.ndefault)]
-        defdir = tempfile.mkdtemp(dir='.')
-        for i,b in enumerate(bot_names):
-            src = os.path.join(botdir, b)
-            dst = os.path.join(defdir, str(i) + '_' + b)
-            os.mkdir(dst)
-            for item in os.listdir(src):
-                s = os.path.join(src, item)
-                d = os.path.join(dst, item)
-                if os.path.isdir(s):
-                    shutil.copytree(s, d)
-                else:
-                    shutil.copy2(s, d)
+        #the copies are kept from run to run, so they only need updating
+        #(and rebuilding) when the default bots change
+        defdir = DEFAULT_COPIES
+        picked = [str(i) + '_' + b for i, b in enumerate(bot_names)]
+        if os.path.isdir(defdir):
+            for old in os.listdir(defdir):
+                if old not in picked:
+                    shutil.rmtree(os.path.join(defdir, old))
+        import buildcache
+        for b, dst in zip(bot_names, picked):
+            buildcache.mirror(os.path.join(botdir, b), 
+                              os.path.join(defdir, dst))
         botdir = defdir
-    game = Controller(botdir = botdir)
+    game = Controller(botdir = botdir, timeout = args.timeout,
+                      forfeit = args.forfeit, width = args.width,
+                      height = args.height, seed = args.seed,
+                      profile = args.profile)
     print 'Game created!'
-    game.run(ng)
+    game.run(ng, jobs=args.jobs, record=args.record)
     print game.leaderboard()
+    print game.timings()
+    if args.profile:
+        print game.stats.report()
     if args.replay:
         for i in range(ng):
             print 'saving replay for game #'+str(i+1)
             game.save_replay(i, 
                              filename='Abotcalypse_Replay_' + str(i + 1)
                                       + '_of_' + str(ng))
-    if args.default:
-        pass
-        #shutil.rmtree(botdir)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+'''benchmarks for the game engine itself. the bots are scripted python
+functions run in-process, so none of the time measured is spent on bot
+processes: it's all Board.step and the parts of the engine it calls.
+every scenario is seeded, so each run does exactly the same work.
+
+for each scenario this reports turns per second and the time per turn
+spent in view, collide, fall_distance and save_snapshot (each including
+whatever they call), plus rendering the game with
+Controller.save_replay. it also times importing the engine in a fresh
+interpreter (which every worker process pays for), next to importing
+numpy alone, which it can't do without. results can be saved as json,
+and compared against a saved baseline: anything slower than the
+tolerance allows is flagged, and the exit status is 1.
+
+Call with "$ python bench.py [-o results.json] [-b baseline.json]",
+or with -h for the rest of the options.'''
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as clock
+
+import numpy as np
+
+from abotcalypse import Board, Controller
+from communicator import PythonBot
+
+PHASES = ['view', 'collide', 'fall_distance', 'save_snapshot']
+NOISE = 0.01 #ms per turn; changes smaller than this are never flagged
+IMPORTS = ['numpy', 'abotcalypse']
+IMPORT_NOISE = 5. #ms, the same for import times
+
+
+def builder(rng):
+    '''drop a rock, climb it, repeat.'''
+    def bot(view):
+        return 'move up' if 'S' in view else 'drop down'
+    return bot
+
+
+def thrower(rng):
+    '''climb a little and throw a lot, both ways.'''
+    def bot(view):
+        if 'S' in view and rng.random() < 0.5:
+            return 'move up'
+        if rng.random() < 0.3:
+            return 'drop down'
+        return 'throw %s %i' % (rng.choice(['left', 'right']),
+                                rng.randint(1, 8))
+    return bot
+
+
+def wanderer(rng):
+    '''wander about, leaving rocks around.'''
+    moves = ['rest', 'move left', 'move right', 'move up', 'drop down',
+             'drop left', 'drop right']
+    def bot(view):
+        return rng.choice(moves)
+    return bot
+
+
+#name: (script, number of bots, width, height)
+SCENARIOS = {'tower': (builder, 10, 100, 100),
+             'throwing': (thrower, 20, 100, 100),
+             'crowd': (wanderer, 300, 400, 100),
+             'meteors': (wanderer, 4, 100, 1000)}
+
+
+class TimedBoard(Board):
+    '''a Board which adds up the time spent in the engine calls being
+    benchmarked. calls made from inside each other are counted in both.'''
+    def __init__(self, *args, **kwargs):
+        self.timings = dict.fromkeys(PHASES, 0.)
+        Board.__init__(self, *args, **kwargs)
+
+    def _timed(phase):
+        method = getattr(Board, phase)
+        def timed(self, *args):
+            start = clock()
+            try:
+                return method(self, *args)
+            finally:
+                self.timings[phase] += clock() - start
+        timed.__name__ = phase
+        timed.__doc__ = method.__doc__
+        return timed
+
+    view = _timed('view')
+    collide = _timed('collide')
+    fall_distance = _timed('fall_distance')
+    save_snapshot = _timed('save_snapshot')
+    del _timed
+
+
+def run_scenario(name, turns=300, seed=0, replay=True):
+    '''play one scenario through; returns its results (times in ms per
+    turn).'''
+    script, nbot, width, height = SCENARIOS[name]
+    bots = [PythonBot('%s_%i' % (name, i), script(random.Random(seed + i)))
+            for i in xrange(nbot)]
+    game = TimedBoard(bots, max_turns=turns + 1, concurrent=False,
+                      width=width, height=height, seed=seed)
+    start = clock()
+    while not game.done:
+        game.step()
+    elapsed = clock() - start
+    played = game._turn
+    result = {'turns': played,
+              'turns_per_sec': played / elapsed,
+              'step': 1000 * elapsed / played}
+    for phase in PHASES:
+        result[phase] = 1000 * game.timings[phase] / played
+    if replay:
+        controller = Controller(None)
+        controller.games = [game]
+        where = tempfile.mkdtemp()
+        try:
+            start = clock()
+            controller.save_replay(0, os.path.join(where, 'replay'))
+            result['save_replay'] = 1000 * (clock() - start) / played
+        finally:
+            shutil.rmtree(where, ignore_errors=True)
+    return result
+
+
+def import_time(module, repeat=5):
+    '''the best time (in ms) to import module in a fresh interpreter,
+    not counting the interpreter's own startup.'''
+    code = ('from timeit import default_timer as clock; start = clock(); '
+            'import %s; print clock() - start' % module)
+    here = os.path.dirname(os.path.abspath(__file__))
+    return 1000 * min(float(subprocess.check_output([sys.executable, '-c',
+                                                     code], cwd=here))
+                      for _ in xrange(repeat))
+
+
+def run(names=None, turns=300, repeat=3, seed=0, replay=True):
+    '''run the scenarios, keeping the best time of repeat runs for
+    every measurement (so noise only ever makes things look slower).'''
+    results = {}
+    for name in names or sorted(SCENARIOS):
+        runs = [run_scenario(name, turns, seed, replay)
+                for _ in xrange(repeat)]
+        best = {key: min(r[key] for r in runs) for key in runs[0]}
+        best['turns_per_sec'] = max(r['turns_per_sec'] for r in runs)
+        results[name] = best
+    imports = {module: import_time(module, max(repeat, 5))
+               for module in IMPORTS}
+    return {'meta': {'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'machine': platform.platform(),
+                     'turns': turns, 'repeat': repeat, 'seed': seed},
+            'results': results, 'imports': imports}
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''find every measurement which got slower than the baseline by
+    more than the tolerance (a fraction); returns (scenario, key, old,
+    new) for each.'''
+    slower = []
+    for name, new in sorted(results['results'].items()):
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        if old['turns'] != new['turns']:
+            print '{}: played {:d} turns, baseline {:d}'.format(
+                name, new['turns'], old['turns'])
+        for key in sorted(new):
+            if key == 'turns' or key not in old:
+                continue
+            if key == 'turns_per_sec':
+                worse = new[key] < old[key] / (1 + tolerance)
+            else:
+                worse = (new[key] > old[key] * (1 + tolerance) and
+                         new[key] - old[key] > NOISE)
+            if worse:
+                slower.append((name, key, old[key], new[key]))
+    old = baseline.get('imports', {})
+    for module, t in sorted(results['imports'].items()):
+        if (module in old and t > old[module] * (1 + tolerance) and
+                t - old[module] > IMPORT_NOISE):
+            slower.append(('import', module, old[module], t))
+    return slower
+
+
+def report(results, baseline=None):
+    '''a table of the results (ms per turn), with the change from the
+    baseline if there is one.'''
+    keys = ['turns_per_sec', 'step'] + PHASES + ['save_replay']
+    rows = ['{:10} '.format('') + ' '.join('{:>14}'.format(k[:14])
+                                           for k in keys)]
+    for name, res in sorted(results['results'].items()):
+        cells = []
+        for key in keys:
+            if key not in res:
+                cells.append('{:>14}'.format('-'))
+                continue
+            cell = '{:.1f}'.format(res[key]) if key == 'turns_per_sec' \
+                   else '{:.3f}'.format(res[key])
+            old = (baseline or {}).get('results', {}).get(name, {}).get(key)
+            if old:
+                cell += ' {:+.0%}'.format(res[key] / old - 1)
+            cells.append('{:>14}'.format(cell))
+        rows.append('{:10} '.format(name) + ' '.join(cells))
+    old = (baseline or {}).get('imports', {})
+    rows.append('import (ms): ' + ', '.join(
+        '{} {:.1f}'.format(module, results['imports'][module]) +
+        (' {:+.0%}'.format(results['imports'][module] / old[module] - 1)
+         if old.get(module) else '')
+        for module in IMPORTS))
+    return '\n'.join(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the engine')
+    parser.add_argument('scenarios', nargs='*', help='any of %s (default: '
+                        'all of them)' % ', '.join(sorted(SCENARIOS)))
+    parser.add_argument('--turns', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-replay', dest='replay', action='store_false',
+                        help="don't time rendering replays")
+    parser.add_argument('-o', '--out', metavar='FILE', default=None,
+                        help='save the results as json')
+    parser.add_argument('-b', '--baseline', metavar='FILE', default=None,
+                        help='compare with results saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='how much slower counts as a regression '
+                             '(default 0.2, i.e. 20%%)')
+
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('no such scenario: ' + name)
+    results = run(args.scenarios, args.turns, args.repeat, args.seed,
+                  args.replay)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print report(results, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if baseline is not None:
+        slower = compare(results, baseline, args.tolerance)
+        for name, key, old, new in slower:
+            print 'REGRESSION {}: {} {:.3f} -> {:.3f}'.format(name, key,
+                                                              old, new)
+        sys.exit(1 if slower else 0)
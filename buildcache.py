@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+'''skip bot build steps which have already been done. the pre-run
+commands in a bot's command.txt are only run again when the files in
+its folder have changed since they last ran successfully; what the
+folder held after that run is remembered, by content hash, in a stamp
+file in the folder.
+
+files a bot writes as it plays (other than errlog.txt and compiled
+python) count as changes too, so a pre-run step which resets a bot's
+storage still runs whenever there's something to reset.'''
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+
+STAMP = '.buildstamp'
+MANIFEST = '.mirrored' #what mirror copied into a folder
+IGNORE = ['errlog.txt', '*.pyc', STAMP, MANIFEST]
+
+
+def _ignored(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IGNORE)
+
+
+def _walk(path):
+    '''(relative path, full path) for each file under path which isn't
+    ignored.'''
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in names:
+            if _ignored(name):
+                continue
+            full = os.path.join(root, name)
+            yield os.path.relpath(full, path).replace(os.sep, '/'), full
+
+
+def scan(path, known=None):
+    '''the files under path, as relative path -> [size, mtime, sha1].
+    files whose size and mtime match an earlier scan (known) aren't
+    read again.'''
+    known = known or {}
+    files = {}
+    for rel, full in _walk(path):
+        info = os.stat(full)
+        old = known.get(rel)
+        if old is not None and old[:2] == [info.st_size, info.st_mtime]:
+            files[rel] = old
+            continue
+        with open(full, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        files[rel] = [info.st_size, info.st_mtime, digest]
+    return files
+
+
+def tree_hash(files, commands=()):
+    '''one hash for a scanned folder (and the commands to run in it).'''
+    h = hashlib.sha1()
+    for rel in sorted(files):
+        h.update(rel + '\0' + files[rel][2] + '\0') #(rel is bytes already)
+    for command in commands:
+        h.update(command + '\0')
+    return h.hexdigest()
+
+
+def _load(path):
+    try:
+        with open(os.path.join(path, STAMP), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def prepare(path, commands):
+    '''run a bot's pre-run commands in its folder, unless they've
+    already been run (successfully) on exactly these files. every
+    command is run, whatever the ones before it returned, but if any
+    failed nothing is remembered, so they all run again next time.
+    returns whether they were run.'''
+    stamp = _load(path)
+    files = scan(path, stamp.get('files'))
+    if stamp.get('hash') == tree_hash(files, commands):
+        return False
+    failed = False
+    for command in commands:
+        if subprocess.call(command.split(" "), cwd=path):
+            failed = True
+    if not failed:
+        files = scan(path, files)
+        with open(os.path.join(path, STAMP), 'w') as f:
+            json.dump({'hash': tree_hash(files, commands), 'files': files},
+                      f)
+    return True
+
+
+def mirror(src, dst):
+    '''bring a copy of a bot's folder up to date: files which are new
+    or changed in src are copied over, and files copied over before
+    which are gone from src are deleted. everything else in dst (what
+    it built, or wrote) is left alone. returns whether anything was
+    copied or deleted.'''
+    copied = False
+    try:
+        with open(os.path.join(dst, MANIFEST), 'r') as f:
+            before = set(rel.encode('utf-8') for rel in json.load(f))
+    except (IOError, ValueError):
+        before = set()
+    now = set(rel for rel, _ in _walk(src))
+    for rel in before - now:
+        gone = os.path.join(dst, *rel.split('/'))
+        if os.path.isfile(gone):
+            os.remove(gone)
+            copied = True
+    for root, dirs, names in os.walk(src):
+        there = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(there):
+            os.makedirs(there)
+        for name in names:
+            if _ignored(name):
+                continue
+            s, d = os.path.join(root, name), os.path.join(there, name)
+            if os.path.isfile(d):
+                si, di = os.stat(s), os.stat(d)
+                #(copies only keep mtimes to the microsecond or so)
+                if (si.st_size == di.st_size and
+                        abs(si.st_mtime - di.st_mtime) < 1e-3):
+                    continue
+            shutil.copy2(s, d)
+            copied = True
+    with open(os.path.join(dst, MANIFEST), 'w') as f:
+        json.dump(sorted(now), f)
+    return copied
@@ -1,45 +1,280 @@
 # -*- coding: utf-8 -*-
 
+import imp
 import select
+import numpy as np
 import os
 import subprocess
 import shlex
+import threading
+import time
 
 
 debug = __debug__
+STOP_GRACE = 0.5 #seconds a bot gets to exit by itself at the end of a game
 WINDOWS = False
 
 try:
     select.poll()
 except AttributeError:
     WINDOWS = True
+
+
+class BotTimeout(Exception):
+    '''raised when a bot blows its time budget for a move.'''
+    pass
     
 
 class Communicator(object):
     '''a class for handling language-agnostic bot interface, via
     subprocess. commands are handled via a commands.txt file in
     the bot's directory, one command per line, with the last command
-    handling the actual interface (everything before it is pre-run).'''
-    def __init__(self, bot_name, command, no_print, botdir = "bots/"):
+    handling the actual interface (everything before it is pre-run).
+
+    by default the interface command is run once per turn, with the view
+    as its last argument. a bot which lists 'persistent' in its
+    options.txt is instead started once per game and fed each view over
+    stdin, terminated by a blank line; it answers with a single line
+    on stdout.
+
+    a persistent bot which also lists 'diff' is sent only what changed
+    since its last view: each frame starts with a header line, either
+    'full' (the whole view follows, one row per line) or
+    'diff <left> <top> <width> <height>', where the new window is
+    width by height and its top left corner is at column left, row
+    top of the last one. each line after that is '<row> <col> <cells>':
+    a run of changed cells, in the new window. cells which weren't in
+    the last window always count as changed. a bot gets a full frame
+    on its first turn, after it's been restarted, and whenever it
+    answers 'resync' (which also counts as resting).
+
+    a bot which lists 'binary' gets its view on stdin, as bytes (see
+    Board.view_binary): a 32 byte header, then one byte per cell, with
+    no blank line after it (the header says how many cells follow). run
+    once per turn, it gets no view argument, just the state (if it
+    asks for that too). binary views aren't diffed.
+
+    a bot which lists 'state' (and runs once per turn) gets a second
+    argument after the view: whatever it handed back last turn, empty on
+    its first turn of each game. to hand something back, it writes it
+    after the first line of its output (the first line is its move).
+    the controller just keeps the last one, in memory, so there's no
+    file to read and rewrite every turn.
+
+    if timeout (in seconds) is set, a bot which takes longer than that
+    to answer is killed and BotTimeout is raised; forfeit tells the
+    game whether that should cost the bot its life or just its turn.'''
+    def __init__(self, bot_name, command, no_print, botdir = "bots/",
+                 persistent = False, timeout = None, forfeit = False,
+                 state = False, diff = False, binary = False):
         self.name = bot_name
         self.no_print = no_print
         self.commands = shlex.split(command)
         self.response = None
         self.cwd = os.path.join(botdir, self.name)
+        self.persistent = persistent
+        self.timeout = timeout
+        self.forfeit = forfeit
+        self.state = state and not persistent
+        self.diff = diff and persistent and not binary
+        self.binary = binary
+        self._window = None #the last view sent, for diffs
+        self._state = ''
+        self._proc = None
+        self._errlog = None
+        self._pending = ''
     
     def __call__(self, message):
         '''pass the input to the bot, and send back the response.'''
-        args = self.commands[:]
-        if message is not None:
-            args.append(message)
-            if debug and not self.no_print:
-                print "sent view to " + self.name + " :\n" + message
-        with open(os.path.join(self.cwd,'errlog.txt'),'a') as f:
-            self.response = subprocess.check_output(args=args, cwd=self.cwd,
-                                                stderr=f).strip()
+        if self.persistent:
+            self.response = self._exchange(message)
+        else:
+            if message is not None and debug and not self.no_print:
+                print ("sent view to " + self.name + " :\n" +
+                       self._shown(message))
+            args = self.commands[:]
+            stdin = None
+            if message is not None:
+                if self.binary:
+                    stdin = buffer(message)
+                else:
+                    args.append(message)
+                if self.state:
+                    args.append(self._state)
+            with open(os.path.join(self.cwd,'errlog.txt'),'a') as f:
+                proc = subprocess.Popen(args=args, cwd=self.cwd,
+                                        stdin=subprocess.PIPE if stdin
+                                              else None,
+                                        stdout=subprocess.PIPE, stderr=f)
+                output = self._guarded(proc,
+                                       lambda: proc.communicate(stdin)[0])
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, args,
+                                                    output)
+            if self.state:
+                output, _, state = output.lstrip('\r\n').partition('\n')
+                self._state = state.rstrip('\r\n')
+            self.response = output.strip()
         if debug and not self.no_print:
             print "got response from "+self.name+" : "+self.response
         return self.response
+
+    def _exchange(self, message):
+        '''send one frame to the persistent process and read back
+        one line. a bot that has died just gives an empty response.'''
+        self.start()
+        frame = '\n' if message is None else self._frame(message)
+        if debug and not self.no_print:
+            print ("sent view to " + self.name + " :\n" +
+                   self._shown(frame))
+        try:
+            self._proc.stdin.write(frame)
+            self._proc.stdin.flush()
+            if WINDOWS:
+                line = self._guarded(self._proc, 
+                                     self._proc.stdout.readline).strip()
+            else:
+                line = self._readline().strip()
+        except IOError:
+            self._window = None
+            return ''
+        except BotTimeout:
+            self.stop(0) #it'll be restarted next turn
+            raise
+        if line == 'resync':
+            self._window = None
+        return line
+
+    def look(self, board, x, y):
+        '''the view this bot wants of the board: the view string, or
+        for diffs, the window it's made from (see Board.view_window).'''
+        if self.binary:
+            return board.view_binary(x, y)
+        if self.diff:
+            return board.view_window(x, y)
+        return board.view(x, y)
+
+    def _frame(self, message):
+        '''what to send for one view, blank line and all (if any).'''
+        if self.binary:
+            return buffer(message)
+        if not self.diff:
+            return message + '\n\n'
+        left, top, rows = message
+        last, self._window = self._window, message
+        height, width = rows.shape
+        if last is None:
+            text = np.empty((height, width + 1), dtype=np.uint8)
+            text[:, :-1] = rows
+            text[:, -1] = ord('\n')
+            return 'full\n' + text.tostring() + '\n'
+        oldleft, oldtop, old = last
+        dx, dy = left - oldleft, top - oldtop
+        #the part of the new window the old one covers
+        r0, r1 = max(0, -dy), min(height, old.shape[0] - dy)
+        c0, c1 = max(0, -dx), min(width, old.shape[1] - dx)
+        changed = np.ones((height, width + 2), dtype=np.int8)
+        changed[:, 0] = changed[:, -1] = 0
+        if r0 < r1 and c0 < c1:
+            changed[r0:r1, c0 + 1:c1 + 1] = (rows[r0:r1, c0:c1] !=
+                old[r0 + dy:r1 + dy, c0 + dx:c1 + dx])
+        edges = np.diff(changed, axis=1)
+        lines = ['diff %i %i %i %i' % (dx, dy, width, height)]
+        for (r, c), (_, e) in zip(np.argwhere(edges == 1),
+                                  np.argwhere(edges == -1)):
+            lines.append('%i %i %s' % (r, c, rows[r, c:e].tostring()))
+        return '\n'.join(lines) + '\n\n'
+
+    def _shown(self, message):
+        '''a view, as printable for debugging'''
+        if self.binary:
+            return '(%i bytes)' % len(message)
+        return message
+
+    def _readline(self):
+        '''read a line from the persistent process, polling so that we
+        give up once the time budget is spent.'''
+        fd = self._proc.stdout.fileno()
+        if self.timeout is not None:
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            deadline = time.time() + self.timeout
+        while '\n' not in self._pending:
+            if self.timeout is not None:
+                wait = deadline - time.time()
+                if wait <= 0 or not poller.poll(wait * 1000):
+                    raise BotTimeout(self.name)
+            chunk = os.read(fd, 4096)
+            if not chunk: #the bot has gone away
+                break
+            self._pending += chunk
+        line, _, self._pending = self._pending.partition('\n')
+        return line
+
+    def _guarded(self, proc, read):
+        '''call read(), killing proc if it takes longer than the 
+        time budget.'''
+        if self.timeout is None:
+            return read()
+        fired = []
+        def kill():
+            fired.append(True)
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        timer = threading.Timer(self.timeout, kill)
+        timer.start()
+        try:
+            result = read()
+        finally:
+            timer.cancel()
+        if fired:
+            raise BotTimeout(self.name)
+        return result
+
+    def start(self):
+        '''a new game: forget the last game's state, and launch the bot
+        process (persistent mode only).'''
+        self._state = ''
+        if not self.persistent or self._proc is not None:
+            return
+        self._errlog = open(os.path.join(self.cwd, 'errlog.txt'), 'a')
+        self._proc = subprocess.Popen(args=self.commands, cwd=self.cwd,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=self._errlog, bufsize=-1)
+
+    def stop(self, grace=STOP_GRACE):
+        '''end of game: close the bot's stdin so it can exit cleanly,
+        and make sure it's gone, killing it if it's still running
+        after grace seconds.'''
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except IOError:
+            pass
+        deadline = time.time() + grace
+        while self._proc.poll() is None and time.time() < deadline:
+            time.sleep(0.01)
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._proc = None
+        self._pending = ''
+        self._window = None
+        self._errlog.close()
+        self._errlog = None
+    
+    def __getstate__(self):
+        '''process handles don't survive pickling (e.g. when handed to
+        a worker process); a copy starts out with no process running.'''
+        state = self.__dict__.copy()
+        state['_proc'] = state['_errlog'] = None
+        state['_pending'] = ''
+        state['_window'] = None
+        return state
     
     @staticmethod
     def read_bot_list(botdir = 'bots/'):
@@ -47,3 +282,71 @@ class Communicator(object):
         which we have commands'''
         return [n for n in os.listdir(botdir)
                 if os.path.isfile(os.path.join(botdir, n, "command.txt"))]
+
+    @staticmethod
+    def read_options(path):
+        '''get the set of protocol options a bot asks for, one
+        keyword per line in its options.txt (if it has one)'''
+        fname = os.path.join(path, "options.txt")
+        if not os.path.isfile(fname):
+            return set()
+        with open(fname, 'r') as f:
+            return set(f.read().split())
+
+
+class PythonBot(object):
+    '''an in-process bot: a python function called with the view,
+    which returns the bot's move as a string, with no process or pipe
+    in the way. with array set it gets the view as an array of
+    characters (see Board.view_array) instead of a string.
+
+    in-process bots run in the controller's working directory, and
+    can't be timed out; they're for trusted bots, for simulations and
+    for testing.'''
+    inprocess = True
+    persistent = False
+    timeout = None
+    forfeit = False
+
+    def __init__(self, bot_name, function, array=False, cwd=None):
+        self.name = bot_name
+        self.function = function
+        self.array = array
+        self.cwd = cwd
+        self.response = None
+
+    def __call__(self, message):
+        self.response = (self.function(message) or '').strip()
+        return self.response
+
+    def look(self, board, x, y):
+        '''the view this bot wants of the board'''
+        if self.array:
+            return board.view_array(x, y)
+        return board.view(x, y)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def __getstate__(self):
+        '''functions don't always pickle; a copy (e.g. in a game sent
+        back from a worker process) is just the bot's name and record.'''
+        state = self.__dict__.copy()
+        state['function'] = None
+        return state
+
+    @classmethod
+    def load(cls, bot_name, command, botdir = 'bots/', array = False):
+        '''load the bot function from the python file in a bot's
+        interface command (e.g. "python builder.py"): the module's
+        bot(view) function.'''
+        cwd = os.path.join(botdir, bot_name)
+        scripts = [a for a in shlex.split(command) if a.endswith('.py')]
+        if not scripts:
+            raise ValueError('no python file in the command for ' + bot_name)
+        module = imp.load_source('_inprocess_' + bot_name,
+                                 os.path.join(cwd, scripts[-1]))
+        return cls(bot_name, module.bot, array=array, cwd=cwd)
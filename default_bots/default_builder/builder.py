@@ -1,7 +1,9 @@
 '''A bot which builds and climbs a tower.
 It builds before it climbs, because building is fun.
 
-Call with "$ python builder.py <input>"'''
+Call with "$ python builder.py <input>", or with no arguments to run
+persistently, reading one view per blank-line-terminated frame on stdin
+(either the view itself, or a 'full'/'diff' frame, see apply_frame).'''
 
 def bot(board):
     symbol = 's' if board.count('s') else 'S'
@@ -32,6 +34,40 @@ def bot(board):
                 }[board[y-1][x]]
     
 
+def apply_frame(rows, lines):
+    '''bring a view (a list of rows) up to date with one frame of the
+    diff protocol (its lines, header first); returns the new rows.'''
+    header = lines[0].split()
+    if header[0] == 'full':
+        return lines[1:]
+    left, top, width, height = [int(n) for n in header[1:]]
+    new = []
+    for r in xrange(height):
+        old = rows[r + top] if 0 <= r + top < len(rows) else ''
+        old = ' ' * -left + old if left < 0 else old[left:]
+        new.append(list(old[:width].ljust(width)))
+    for line in lines[1:]:
+        r, c, cells = line.split(' ', 2)
+        c = int(c)
+        new[int(r)][c:c + len(cells)] = cells
+    return [''.join(row) for row in new]
+
+
 if __name__ == "__main__":
     import sys
-    print bot(sys.argv[1])
+    if len(sys.argv) > 1:
+        print bot(sys.argv[1])
+    else:
+        rows, view = [], []
+        for line in iter(sys.stdin.readline, ''):
+            line = line.rstrip('\n')
+            if line:
+                rows.append(line)
+                continue
+            if rows and rows[0].split()[0] in ('full', 'diff'):
+                view = apply_frame(view, rows)
+            else:
+                view = rows
+            sys.stdout.write(bot('\n'.join(view)) + '\n')
+            sys.stdout.flush()
+            rows = []
@@ -1,26 +1,26 @@
 from __future__ import print_function
 '''A bot which moves around and throws rocks at stuff in its way.
 
-Call with "$ python thrower.py" and then at each prompt, "next <input>"'''
+Call with "$ python thrower.py <state>" and the view on stdin, in the
+binary format (see read_view); state is what it printed after its move
+last turn (its options.txt asks the controller for both).'''
 
 import json
-import os
+import struct
 import sys
 
+#x, y, col, row, left, top, width, height
+HEADER = struct.Struct('<8i')
+
 DIRECTIONS = {'left': (-1, 0),
               'right': (1, 0)}
 THROW = ['e','E','&']
 RUN = ['@', '#', '']
 RUN_DIR = {'left': 'right', 'right':'left'}
 
-history = []
-
 
 class Bot(object):
-    def __init__(self, store = 'storage.txt'):
-        if not os.path.isfile(store): #ensure existence of store
-            open(store,'w').close()
-        self.storage = store
+    def __init__(self):
         self.x = self.y = 0
         self.previous_xy = (0, 0)
         self.previous_move = 'left'
@@ -29,44 +29,43 @@ class Bot(object):
         self.current_action = 'rest'
         self.neighbors = {}
         self.current_symbol = 's'
-        self.board = ''
+        self.board = []
         self.turn = 0
     
     @property
     def current_xy(self):
         return self.x, self.y
         
-    def load(self, i=-1):
-        global history
-        try:
-            with open(self.storage, 'r') as f:
-                history = json.load(f)
-                self.__dict__ = history[i]
-        except ValueError:
-            pass
+    def load(self, state):
+        '''pick up where we left off (the state we handed back last
+        turn, if any)'''
+        if state:
+            self.__dict__.update(json.loads(state))
     
     def save(self):
-        try:
-            with open(self.storage, 'r') as f:
-                history = json.load(f)
-        except ValueError:
-            history = []
-        history.append(self.__dict__)
-        with open(self.storage, 'w') as f:
-            json.dump(history, f)
+        '''the state to hand back, for next turn (the board gets sent
+        again anyway)'''
+        state = dict(self.__dict__)
+        del state['board']
+        return json.dumps(state)
     
-    def read_board(self):
+    def read_view(self, data):
+        '''a binary view: the header (where we are, in the view and on
+        the board, and the view's bounds), then width * height cells,
+        one character each, top row first.'''
+        header = HEADER.unpack_from(data)
+        width, height = header[6:]
+        cells = data[HEADER.size:HEADER.size + width * height]
+        self.board = [cells[i:i + width]
+                      for i in range(0, width * height, width)]
+        return header
+
+    def read_board(self, data):
         self.turn += 1
-        self.symbol = 's' if self.board.count('s') else 'S'
         self.previous_xy = self.current_xy[:]
-        board = self.board.splitlines()
-        #find self
-        for y, row in enumerate(board):
-            x = row.find(self.symbol)
-            if x >= 0:
-                break
-        else:
-            self.x, self.y = self.previous_xy
+        x, y = self.read_view(data)[2:4]
+        board = self.board
+        self.symbol = board[y][x]
         self.x = x 
         self.y = y
         for d, (dx, dy) in DIRECTIONS.items():
@@ -110,18 +109,17 @@ class Bot(object):
         self.current_action = 'move ' + move
         return self.current_action
     
-    def act(self, board):
-        self.load()
-        self.board = board
-        self.read_board()
+    def act(self, data, state=''):
+        self.load(state)
+        self.read_board(data)
         action = self.action()
         pre = self.previous_action.split()
         cur = self.current_action.split()
         if (pre[0] == 'throw' and self.neighbors[pre[1]] in THROW and not cur[0] == 'throw'):
             print('failed at {:d}'.format(self.turn), file=sys.stderr)
-        self.save()
         print(action)
+        print(self.save())
 
 if __name__ == "__main__":
     bot = Bot()
-    bot.act(sys.argv[1])
+    bot.act(sys.stdin.read(), *sys.argv[1:2])
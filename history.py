@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''compact game histories, for replays. each turn is stored as what
+changed since the turn before (rocks added and removed, bots which moved
+or died, meteors which fell or burnt out), with a full keyframe every so
+often, so any turn can be rebuilt without keeping the whole board around
+for every turn of every game. each turn's record also keeps the moves
+the bots made that turn, and the history keeps the game's seed, which
+together are enough to play the game again exactly.
+
+a meteor's path is fixed once it sets off, so meteors are kept as
+(x0, y0, angle, age): where and how it set off, and how many steps it's
+taken since (see trajectory.fall_path). keyframes list those for every
+meteor in the air; deltas list the new meteors ('fell', without the age,
+which is 0) and the places in the last turn's list of the meteors which
+are gone ('burnt'). records from older replays just have every meteor's
+position ('meteors').'''
+
+from trajectory import fall_path
+
+KEYFRAME_EVERY = 50
+
+
+def step_meteors(meteors, record):
+    '''the meteors in the air after a record, from those before it.'''
+    if 'meteors' in record: #old records: positions
+        return list(record['meteors'])
+    if record.get('key'):
+        return list(record['falling'])
+    burnt = set(record['burnt'])
+    return ([(x0, y0, angle, age + 1) for i, (x0, y0, angle, age)
+             in enumerate(meteors) if i not in burnt] +
+            [m + (0,) for m in record['fell']])
+
+
+def meteor_positions(meteors):
+    '''the (x, y) of each meteor.'''
+    cells = []
+    for m in meteors:
+        if len(m) == 2:
+            cells.append(tuple(m))
+            continue
+        x0, y0, angle, age = m
+        xs, ys = fall_path(x0, y0, angle, age + 1)
+        cells.append((int(xs[age]), int(ys[age])))
+    return cells
+
+
+def apply_record(state, record):
+    '''bring a (rocks, bots, meteors) state forward by one record.
+    rocks is a set of (x, y), bots a dict of bot index -> (x, y), and
+    meteors a list of (x0, y0, angle, age).'''
+    rocks, bots, meteors = state
+    if record.get('key'):
+        rocks = set(record['rocks'])
+        bots = dict(record['bots'])
+    else:
+        rocks.difference_update(record['rocks-'])
+        rocks.update(record['rocks+'])
+        for i in record['died']:
+            del bots[i]
+        bots.update(record['moved'])
+    return rocks, bots, step_meteors(meteors, record)
+
+
+def as_snapshot(state):
+    '''turn a state into the old full-snapshot format: lists of bot,
+    rock and meteor positions (bots in bot order, rocks row by row).'''
+    rocks, bots, meteors = state
+    return {'bots': [bots[i] for i in sorted(bots)],
+            'rocks': sorted(rocks, key=lambda xy: (xy[1], xy[0])),
+            'meteors': meteor_positions(meteors)}
+
+
+class History(object):
+    '''the record of a game, one entry per turn. indexing it gives back
+    full snapshots (see as_snapshot), rebuilt from the nearest keyframe;
+    walking through it in order only applies one delta per turn.
+    records can be any sequence of records (e.g. read from a file).
+    seed is the seed of the game's random number generator, if known.'''
+    def __init__(self, keyframe_every=KEYFRAME_EVERY, records=None,
+                 seed=None):
+        self.keyframe_every = keyframe_every
+        self.seed = seed
+        self.records = [] if records is None else records
+        self._rocks = set()
+        self._bots = {}
+        self._meteors = []
+        self._cursor = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, turn):
+        return as_snapshot(self.state_at(turn))
+
+    def __iter__(self):
+        state = set(), {}, []
+        for record in self.records:
+            state = apply_record(state, record)
+            yield as_snapshot(state)
+
+    def append(self, rock_changes, bots, meteors, actions=None):
+        '''record a turn. rock_changes is a list of (x, y, has_rock) for
+        every square whose rock might have changed; bots maps bot index
+        to position for each bot still alive; meteors is a list of
+        (x0, y0, angle, age) for each meteor in the air; actions (if
+        given) maps bot index to the (action, direction, distance) it
+        played this turn.'''
+        added, removed = [], []
+        for x, y, has_rock in rock_changes:
+            if has_rock and (x, y) not in self._rocks:
+                added.append((x, y))
+                self._rocks.add((x, y))
+            elif not has_rock and (x, y) in self._rocks:
+                removed.append((x, y))
+                self._rocks.remove((x, y))
+        #a meteor is known by how it set off and when
+        turn = len(self.records)
+        falling = [(x0, y0, angle, turn - age)
+                   for x0, y0, angle, age in meteors]
+        if turn % self.keyframe_every == 0:
+            record = {'key': True, 'rocks': sorted(self._rocks),
+                      'bots': dict(bots),
+                      'falling': [tuple(m) for m in meteors]}
+        else:
+            now, before = set(falling), set(self._meteors)
+            record = {'rocks+': added, 'rocks-': removed,
+                      'moved': {i: xy for i, xy in bots.items()
+                                if self._bots.get(i) != xy},
+                      'died': [i for i in self._bots if i not in bots],
+                      'fell': [m[:3] for m in falling if m not in before],
+                      'burnt': [i for i, m in enumerate(self._meteors)
+                                if m not in now]}
+        if actions is not None:
+            record['actions'] = dict(actions)
+        self._bots = dict(bots)
+        self._meteors = falling
+        self.records.append(record)
+
+    def state_at(self, turn):
+        '''rebuild the (rocks, bots, meteors) state at a given turn.'''
+        if turn < 0:
+            turn += len(self.records)
+        if not 0 <= turn < len(self.records):
+            raise IndexError('no such turn: %i' % turn)
+        key = turn - turn % self.keyframe_every
+        if self._cursor is not None and key <= self._cursor[0] <= turn:
+            start, state = self._cursor
+            state = set(state[0]), dict(state[1]), state[2]
+        else:
+            start, state = key - 1, (set(), {}, [])
+        for record in self.records[start + 1:turn + 1]:
+            state = apply_record(state, record)
+        self._cursor = turn, state
+        return set(state[0]), dict(state[1]), list(state[2])
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import random
+import numpy as np
 from string import ascii_uppercase, ascii_lowercase, digits, punctuation
 import select
 import os
@@ -16,6 +17,13 @@ except AttributeError:
     WINDOWS = True
 
 all_voices = ascii_uppercase + ascii_lowercase + digits + punctuation
+
+def make_voices(n):
+    '''n different one-character voices: the printable ascii ones, then
+    (for meetings bigger than that) unicode ones, which go out utf-8
+    encoded, in the register too (see Meeting.quoted).'''
+    extra = max(0, n - len(all_voices))
+    return list(all_voices[:n]) + [unichr(0x100 + i) for i in xrange(extra)]
     
 class Communicator(object):
     '''a class for handling language-agnostic bot interface, via
@@ -53,70 +61,134 @@ class Communicator(object):
 class Bot(object):
     '''the controller-side implementation for a bot (with the bot-side
     implementation contributed by whatever author)'''
-    def __init__(self, logic=None, voice='A', start_pos = []):
+    def __init__(self, logic=None, voice='A', index=0):
         self.logic = logic
         self.voice = voice
+        self.index = index
         self.name = logic.name
-        self.score = 0
-        self.pos = start_pos
     
-    def __call__(self, register):
-        points = 20 * register.count(self.voice)
-        output = self.logic(' '.join([self.voice, str(self.bank), str(points), `register`]))
+    def __call__(self, register, points, bank, size):
+        '''register is the quoted register (the same for everyone, so
+        it's only made once), and size its length. ask for this turn's
+        bids, "slot amount|slot amount|..." with
+        slots counted from 1. returns a list of (slot, amount), slots
+        counted from 0, or None if the bids aren't valid (bad syntax, a
+        slot off the register, a negative amount, or more than points in
+        all).'''
+        output = self.logic(' '.join([self.voice.encode('utf-8'), str(bank),
+                                      str(points), register]))
+        if not output.strip():
+            return []
         try:
-            bids = dict([map(int,x.split()) for x in output.split('|')])
-            bids = {k-1:v for k,v in bids.iteritems()}
-            totalbid = sum(bids.values())
-            if totalbid > self.points: 1/0
-            self.score += self.points - totalbid
-            return bids
-        except:
+            bids = dict(map(int, x.split()) for x in output.split('|'))
+        except ValueError:
             return None
-    
-    def update_pos(self, new_pos = []):
-        self.pos = new_pos
-        self.score += sum(self.pos) + len(self.pos)
+        if (sum(bids.values()) > points or 
+                any(v < 0 for v in bids.values()) or
+                any(not 1 <= k <= size for k in bids)):
+            return None
+        return [(k - 1, v) for k, v in bids.iteritems()]
 
 class Meeting(object):
-    '''The game itself'''
-    def __init__(self, bot_list, max_turns = 100):
-        random.shuffle(bot_list)
+    '''The game itself. the register is an array of owner ids (the
+    bots' places in the list, -1 for nobody), and everything done with
+    it each turn (counting, scoring, settling the bids) works on whole
+    arrays, so big meetings stay quick.
+
+    each turn a bot may spend 20 points for every slot it owns, bidding
+    on any slots it likes; points it doesn't spend go to its score. a
+    slot goes to its highest bidder, unless two or more tie for highest,
+    in which case it stays with whoever had it. then every bot scores
+    each slot it owns, by its place in the register (the first slot is
+    worth 1). the register starts out dealt evenly (at random) to the
+    bots, with any slots left over owned by nobody.'''
+    def __init__(self, bot_list, max_turns = 100, seed = None):
+        self.rng = random.Random(seed)
+        bot_list = list(bot_list)
+        self.rng.shuffle(bot_list)
         self._botlist = bot_list
-        self.len = max(100,4*len(bot_list))
-        self._register = [' ']*self.len
-        voices = all_voices[:len(bot_list)]
-        self._bots = [Bot(logic=b, voice=voices[i]) 
+        n = len(bot_list)
+        self.len = max(100,4*n)
+        voices = make_voices(n)
+        self._bots = [Bot(logic=b, voice=voices[i], index=i) 
                         for i,b in enumerate(self._botlist)]
+        self._table = np.array(voices + [u' '], dtype='<U1') #-1 -> ' '
+        self._owner = -np.ones(self.len, dtype=np.int64)
+        share = self.len // n if n else 0
+        dealt = self.rng.sample(xrange(self.len), share * n)
+        self._owner[dealt] = np.repeat(np.arange(n), share)
+        self.scores = np.zeros(n, dtype=np.int64)
         self._turn = 0
         self.history = []
         self.save_snapshot()
         self.max_turns = max_turns - 1
-        self.done = False
+        self.done = self._turn >= self.max_turns
     
     def __repr__(self):
-        return ''.join(self._register)
+        '''the register, one voice per slot (utf-8 encoded)'''
+        text = self._table[self._owner]
+        return text.view('<U%i' % self.len)[0].encode('utf-8')
+
+    def quoted(self):
+        '''the register as sent to the bots: in quotes, and (while the
+        voices are all ascii) escaped like a python string literal, as
+        it always has been. with unicode voices it's just put in quotes,
+        raw, so that every bot can find its voice in it.'''
+        register = repr(self)
+        if len(self._bots) > len(all_voices):
+            return "'" + register + "'"
+        return repr(register)
+
+    def play(self):
+        while not self.done:
+            self.step()
     
     def step(self):
-        if self._turn >= self.max_turns:
+        if self.done:
             return
         self._turn += 1
-        register = `self`
-        bids = {bot(register) for bot in self._bots}
-        bids = {k:v for k,v in bids.iteritems() if v != None}
-        pos = {x:(self._register[x], 0) for x in xrange(self.len)}
-        for bot, bid in bids.items():
-            for p, b in bid.items():
-                if b[1] > pos[p][1]: pos[p] = (bot.voice, b)
-                elif b[1] == pos[p][1]: pos[p] = (self._register[p], b)
-        self._register = [pos[p][0] for p in xrange(self.len)]
-        new_pos = {bot.voice:list() for bot in self._bots}
-        for ind, voice in enumerate(self._register):
-            new_pos[voice] += ind,
+        n = len(self._bots)
+        register = self.quoted()
+        owned = self._owner >= 0
+        points = 20 * np.bincount(self._owner[owned], minlength=n)
+        bidder, slot, amount = [], [], []
         for bot in self._bots:
-            bot.update_pos(new_pos[bot.voice])
+            bids = bot(register, points[bot.index], self.scores[bot.index],
+                       self.len)
+            if bids is None: #no bids, and no points banked either
+                continue
+            self.scores[bot.index] += points[bot.index] - sum(
+                                          v for _, v in bids)
+            bidder.extend([bot.index] * len(bids))
+            for k, v in bids:
+                slot.append(k)
+                amount.append(v)
+        self._settle(np.array(bidder, dtype=np.int64),
+                     np.array(slot, dtype=np.int64),
+                     np.array(amount, dtype=np.int64))
+        owned = self._owner >= 0
+        self.scores += np.bincount(self._owner[owned],
+                                   weights=np.flatnonzero(owned) + 1,
+                                   minlength=n).astype(np.int64)
+        self.done = self._turn >= self.max_turns
         self.save_snapshot()
+
+    def _settle(self, bidder, slot, amount):
+        '''hand each slot to its highest bidder, if there's just one.
+        the bids are sorted by slot and then amount (highest first), so
+        the top bid for each slot is the first of its run, and it's a tie
+        if the next bid in the run is the same.'''
+        if not len(slot):
+            return
+        order = np.lexsort((-amount, slot))
+        bidder, slot, amount = bidder[order], slot[order], amount[order]
+        top = np.flatnonzero(np.r_[True, slot[1:] != slot[:-1]])
+        tied = np.r_[(slot[1:] == slot[:-1]) & (amount[1:] == amount[:-1]),
+                     False][top]
+        win = top[(amount[top] > 0) & ~tied]
+        self._owner[slot[win]] = bidder[win]
     
-    def save_snaphot(self):
-        self.history[self._turn] = (`self`, [(bot.name, 
-                                              bot.voice, 
-                                              bot.score) for bot in self._bots])
\ No newline at end of file
+    def save_snapshot(self):
+        self.history.append((repr(self), [(bot.name, bot.voice, 
+                                           int(self.scores[bot.index]))
+                                          for bot in self._bots]))
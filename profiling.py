@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+'''where a game's time goes. a Board made with profile=True keeps a
+Stats: the time spent in each phase of a turn, how often the busiest
+engine methods were called, and a per-bot breakdown of the time spent
+asking each bot for its move. stats from several games add up with
+merge (Controller.run does this for all its games). a game without
+profiling has no Stats at all, and pays only for checking that.'''
+
+from timeit import default_timer as clock
+
+#the phases of Board.step, in order
+PHASES = ['decide', 'forfeit', 'rest', 'move', 'drop', 'throw',
+          'collisions', 'meteors', 'cleanup', 'snapshot']
+#the engine methods whose calls are counted
+COUNTED = ['collide', 'crush', 'fall_distance', 'throw_rock', 'place_rock']
+#the parts of a bot's turn: building its view, the bot itself, and
+#reading its answer
+BOT_PARTS = ['view', 'logic', 'parse']
+
+
+class Stats(object):
+    '''timings (in seconds) and call counts for one or more games.'''
+    def __init__(self):
+        self.games = 0
+        self.turns = 0
+        self.phases = dict.fromkeys(PHASES, 0.)
+        self.calls = dict.fromkeys(COUNTED, 0)
+        self.bots = {}
+        self._last = None
+
+    def start(self):
+        '''start timing a turn.'''
+        self.turns += 1
+        self._last = clock()
+
+    def lap(self, phase):
+        '''charge the time since the last lap (or start) to phase.'''
+        now = clock()
+        self.phases[phase] += now - self._last
+        self._last = now
+
+    def bot(self, name, *times):
+        '''add one turn's view, logic and parse times for a bot.'''
+        entry = self.bots.get(name)
+        if entry is None:
+            entry = self.bots[name] = [0.] * len(BOT_PARTS) + [0]
+        for i, t in enumerate(times):
+            entry[i] += t
+        entry[-1] += 1
+
+    def counted(self, name, method):
+        '''wrap method so that its calls are counted under name.'''
+        calls = self.calls
+        def counted(*args):
+            calls[name] += 1
+            return method(*args)
+        counted.__name__ = name
+        counted.__doc__ = method.__doc__
+        return counted
+
+    def merge(self, other):
+        '''add another Stats into this one.'''
+        self.games += other.games
+        self.turns += other.turns
+        for phase, t in other.phases.items():
+            self.phases[phase] = self.phases.get(phase, 0.) + t
+        for name, n in other.calls.items():
+            self.calls[name] = self.calls.get(name, 0) + n
+        for name, entry in other.bots.items():
+            mine = self.bots.setdefault(name, [0.] * len(entry))
+            for i, x in enumerate(entry):
+                mine[i] += x
+        return self
+
+    def as_dict(self):
+        '''the stats as plain data (e.g. for json).'''
+        return {'games': self.games, 'turns': self.turns,
+                'phases': dict(self.phases), 'calls': dict(self.calls),
+                'bots': {name: dict(zip(BOT_PARTS + ['moves'], entry))
+                         for name, entry in self.bots.items()}}
+
+    def report(self):
+        '''an ok-formatted table, in ms per turn (or per move, for the
+        bots).'''
+        turns = max(self.turns, 1)
+        total = sum(self.phases.values()) or 1.
+        rows = ['{:d} games, {:d} turns'.format(self.games, self.turns)]
+        for phase in PHASES:
+            t = self.phases.get(phase, 0.)
+            rows.append('{:20} -> {:8.3f}ms {:5.1%}'.format(
+                        phase, 1000 * t / turns, t / total))
+        for name in COUNTED:
+            rows.append('{:20} -> {:8.1f} calls/turn'.format(
+                        name, self.calls.get(name, 0) / float(turns)))
+        rows.append('{:20}    {:>8} {:>8} {:>8}'.format('', *BOT_PARTS))
+        for name in sorted(self.bots, key=lambda n: -sum(self.bots[n][:-1])):
+            entry = self.bots[name]
+            moves = max(entry[-1], 1)
+            rows.append('{:20} -> '.format(name) + ' '.join(
+                        '{:6.2f}ms'.format(1000 * t / moves)
+                        for t in entry[:-1]))
+        return '\n'.join(rows)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+'''fast replay rendering. frames are built straight from a game's
+history records: a small coded grid (rock, bot and meteor bits) is kept
+up to date from the deltas, and each frame is one lookup into a colour
+table, scaled up with np.repeat. frames go either to ffmpeg as raw rgb
+over a pipe, or (with nothing else installed) to a directory of pngs.
+
+Call with "$ python render.py <replay.abr> <output>" to render a replay
+file; output ending in .webm/.mp4/.gif goes through ffmpeg, anything
+else is taken as a directory for pngs.'''
+
+import os
+import struct
+import subprocess
+import zlib
+
+import numpy as np
+
+from history import step_meteors, meteor_positions
+
+_FFMPEG = []
+
+COLOR = {'.': [0.95, 0.95, 0.95],
+         '&': [0.2, 0.2, 0.2],
+         'b': [0., 1., 0.],
+         'B': [0.2, 0.6, 0.6],
+         '@': [1., 0., 0.],
+         '#': [0., 0., 0.]}
+
+ROCK, BOT, METEOR = 1, 2, 4
+PALETTE = np.array([COLOR[c] for c in '.&bB@@@@']) * 255
+PALETTE = PALETTE.round().astype(np.uint8)
+
+
+def ffmpeg():
+    '''the path to ffmpeg, or None. it's only looked for the first time
+    it's asked for.'''
+    if not _FFMPEG:
+        from distutils.spawn import find_executable
+        _FFMPEG.append(find_executable('ffmpeg'))
+    return _FFMPEG[0]
+
+
+def frames(records, width=100, height=100, scale=1):
+    '''yield an rgb uint8 frame (top row first) for each history record.'''
+    rocks = np.zeros((height, width), dtype=np.uint8)
+    bots = {}
+    meteors = []
+    for record in records:
+        if record.get('key'):
+            rocks[...] = 0
+            bots = dict(record['bots'])
+            _set(rocks, record['rocks'], ROCK)
+        else:
+            _set(rocks, record['rocks-'], 0)
+            _set(rocks, record['rocks+'], ROCK)
+            for i in record['died']:
+                del bots[i]
+            bots.update(record['moved'])
+        meteors = step_meteors(meteors, record)
+        board = rocks.copy()
+        _set(board, bots.values(), BOT, add=True)
+        _set(board, meteor_positions(meteors), METEOR, add=True)
+        img = PALETTE[board[::-1]]
+        if scale > 1:
+            img = img.repeat(scale, axis=0).repeat(scale, axis=1)
+        yield img
+
+
+def _set(board, cells, code, add=False):
+    '''set (or, with add, or in) a code at a list of (x, y) cells.'''
+    if not len(cells):
+        return
+    x, y = np.array(list(cells)).T
+    if add:
+        board[y, x] |= code
+    else:
+        board[y, x] = code
+
+
+def write_video(frames, filename, fps=30):
+    '''pipe raw frames into ffmpeg, which picks the codec from the
+    filename.'''
+    frames = iter(frames)
+    first = next(frames)
+    height, width = first.shape[:2]
+    args = [ffmpeg() or 'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', '%ix%i' % (width, height), '-r', str(fps), '-i', '-']
+    if filename.endswith('.webm'):
+        args += ['-vcodec', 'libvpx', '-b:v', '1M']
+    elif filename.endswith('.mp4'):
+        args += ['-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+    proc = subprocess.Popen(args + [filename], stdin=subprocess.PIPE)
+    try:
+        proc.stdin.write(first.tostring())
+        for frame in frames:
+            proc.stdin.write(frame.tostring())
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+
+
+def png(frame, level=1):
+    '''encode one rgb frame as a png.'''
+    height, width = frame.shape[:2]
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = frame.reshape(height, -1)
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    return ('\x89PNG\r\n\x1a\n' +
+            chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                      0, 0, 0)) +
+            chunk('IDAT', zlib.compress(raw.tostring(), level)) +
+            chunk('IEND', ''))
+
+
+def write_pngs(frames, dirname):
+    '''write frames to dirname as frame_00000.png, frame_00001.png...'''
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    for i, frame in enumerate(frames):
+        with open(os.path.join(dirname, 'frame_%05i.png' % i), 'wb') as f:
+            f.write(png(frame))
+
+
+def save(records, filename, width=100, height=100, scale=None, fps=30):
+    '''render a whole replay to a video file (if ffmpeg is around and
+    filename has a video extension) or to a directory of pngs.'''
+    video = os.path.splitext(filename)[1] in ('.webm', '.mp4', '.gif')
+    if video and ffmpeg() is None:
+        raise RuntimeError('ffmpeg not found, so no ' + filename)
+    if scale is None: #about 600 (or 400) pixels across
+        scale = max(1, (600 if video else 400) // max(width, height))
+    images = frames(records, width, height, scale)
+    if video:
+        write_video(images, filename, fps)
+    else:
+        write_pngs(images, filename)
+
+
+if __name__ == "__main__":
+    import sys
+    from replayfile import ReplayReader
+    replay = ReplayReader(sys.argv[1])
+    save(replay, sys.argv[2], replay.width, replay.height)
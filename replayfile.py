@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+'''a compact on-disk replay format, so games can be archived and looked
+at later without keeping them in memory.
+
+layout (all little-endian):
+    header: 'ABRP', version (u2), width, height, keyframe interval (u2),
+            seed (i8, -1 if unknown), bot count (u2), then each bot name
+            as a u2 length and utf-8 bytes
+    records: one per turn, a u4 length followed by the payload, which is
+            a u1 kind (0 = delta, 1 = keyframe) and then lists of
+            u2 values, each prefixed by its (u4) item count:
+                keyframe: rocks (x, y), bots (index, x, y),
+                          meteors in the air (x0, y0, -angle, age)
+                delta: rocks added, rocks removed, bots moved,
+                       bots died (index), meteors which fell this turn
+                       (x0, y0, -angle), meteors gone (their places in
+                       the last turn's list)
+            (see history.py: a meteor's path follows from how it set
+            off, so that's all that's kept; versions 1 and 2 had every
+            meteor's position in every record, which was most of a file)
+            and then, if the bots' moves were recorded, a counted list of
+            i4 (index, action, direction, distance) rows: action and
+            direction are positions in ACTIONS and DIRECTIONS, and a
+            missing distance is NO_DISTANCE
+    footer (once the game is over): the u8 offset of every record, then
+            the u8 offset of that index, the u4 record count and 'ABRI'
+
+records are written as the game goes, so a file whose game never
+finished can still be read; it just has to be scanned for its records
+instead of using the index.'''
+
+import mmap
+import struct
+
+import numpy as np
+
+from history import History
+
+MAGIC = 'ABRP'
+INDEX_MAGIC = 'ABRI'
+VERSION = 3 #version 1 had no moves, 1 and 2 had meteor positions
+HEADER = struct.Struct('<4sHHHHqH')
+TRAILER = struct.Struct('<QI4s')
+LENGTH = struct.Struct('<I')
+
+DELTA, KEYFRAME = 0, 1
+FIELDS = {KEYFRAME: [('rocks', 2), ('bots', 3), ('falling', 4)],
+          DELTA: [('rocks+', 2), ('rocks-', 2), ('moved', 3), ('died', 1),
+                  ('fell', 3), ('burnt', 1)]}
+OLD_FIELDS = {KEYFRAME: [('rocks', 2), ('bots', 3), ('meteors', 2)],
+              DELTA: [('rocks+', 2), ('rocks-', 2), ('moved', 3),
+                      ('died', 1), ('meteors', 2)]}
+ACTIONS = ['forfeit', 'rest', 'move', 'drop', 'throw']
+DIRECTIONS = [None, 'up', 'down', 'left', 'right']
+NO_DISTANCE = -2 ** 31
+
+
+def _pack(items, width, dtype='<u2'):
+    '''pack a list of ints (width 1) or tuples into a counted array.'''
+    data = np.array(items, dtype=dtype).reshape(-1, width)
+    return LENGTH.pack(len(data)) + data.tostring()
+
+
+def _unpack(data, pos, width, dtype='<u2'):
+    '''read a counted array back as a list of ints or tuples, and where
+    it ends.'''
+    count, = LENGTH.unpack_from(data, pos)
+    pos += LENGTH.size
+    items = np.frombuffer(data, dtype=dtype, count=count * width,
+                          offset=pos).reshape(-1, width).tolist()
+    pos += np.dtype(dtype).itemsize * count * width
+    return ([tuple(_) for _ in items] if width > 1 else
+            [_[0] for _ in items]), pos
+
+
+def encode_record(record):
+    '''turn a History record into bytes.'''
+    kind = KEYFRAME if record.get('key') else DELTA
+    fields = dict(record)
+    #(angles are all negative, so they're stored flipped)
+    if kind == KEYFRAME:
+        fields['bots'] = [(i, x, y) for i, (x, y) in
+                          sorted(record['bots'].items())]
+        fields['falling'] = [(x0, y0, -angle, age) for x0, y0, angle, age
+                             in record['falling']]
+    else:
+        fields['moved'] = [(i, x, y) for i, (x, y) in
+                           sorted(record['moved'].items())]
+        fields['fell'] = [(x0, y0, -angle) for x0, y0, angle
+                          in record['fell']]
+    data = chr(kind) + ''.join(_pack(fields[name], width)
+                               for name, width in FIELDS[kind])
+    if 'actions' in record:
+        data += _pack([(i, ACTIONS.index(act), DIRECTIONS.index(direction),
+                        NO_DISTANCE if distance is None else distance)
+                       for i, (act, direction, distance) in
+                       sorted(record['actions'].items())], 4, '<i4')
+    return data
+
+
+def decode_record(data, version=VERSION):
+    '''turn bytes back into a History record.'''
+    kind = ord(data[0])
+    record, pos = {}, 1
+    for name, width in (FIELDS if version >= 3 else OLD_FIELDS)[kind]:
+        record[name], pos = _unpack(data, pos, width)
+    if pos < len(data):
+        actions, pos = _unpack(data, pos, 4, '<i4')
+        record['actions'] = {i: (ACTIONS[act], DIRECTIONS[direction],
+                                 None if distance == NO_DISTANCE
+                                 else distance)
+                             for i, act, direction, distance in actions}
+    if kind == KEYFRAME:
+        record['key'] = True
+        record['bots'] = {i: (x, y) for i, x, y in record['bots']}
+        if version >= 3:
+            record['falling'] = [(x0, y0, -angle, age) for x0, y0, angle,
+                                 age in record['falling']]
+    else:
+        record['moved'] = {i: (x, y) for i, x, y in record['moved']}
+        if version >= 3:
+            record['fell'] = [(x0, y0, -angle) for x0, y0, angle
+                              in record['fell']]
+    return record
+
+
+class ReplayWriter(object):
+    '''streams a game's History records to disk as they're made.'''
+    def __init__(self, filename, names, width=100, height=100,
+                 keyframe_every=None, seed=None):
+        self._file = open(filename, 'wb')
+        self._offsets = []
+        keyframe_every = keyframe_every or History().keyframe_every
+        self._file.write(HEADER.pack(MAGIC, VERSION, width, height,
+                                     keyframe_every,
+                                     -1 if seed is None else seed,
+                                     len(names)))
+        for name in names:
+            name = name.encode('utf-8')
+            self._file.write(struct.pack('<H', len(name)) + name)
+
+    def write(self, record):
+        '''append one turn's record.'''
+        data = encode_record(record)
+        self._offsets.append(self._file.tell())
+        self._file.write(LENGTH.pack(len(data)) + data)
+
+    def close(self):
+        '''write the index and finish the file.'''
+        if self._file is None:
+            return
+        where = self._file.tell()
+        self._file.write(np.array(self._offsets, dtype='<u8').tostring())
+        self._file.write(TRAILER.pack(where, len(self._offsets),
+                                      INDEX_MAGIC))
+        self._file.close()
+        self._file = None
+
+
+class ReplayReader(object):
+    '''random access to a replay file. the file is memory-mapped, and
+    records are only decoded when asked for. indexing gives records;
+    .history is a History built on the file, which gives snapshots.'''
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.version, self.width, self.height, self.keyframe_every,
+         seed, nbot) = HEADER.unpack_from(self._map, 0)
+        version = self.version
+        if magic != MAGIC:
+            raise ValueError('%s is not a replay file' % filename)
+        if version > VERSION:
+            raise ValueError('replay format version %i is too new' % version)
+        self.seed = None if seed < 0 else seed
+        self.names, pos = [], HEADER.size
+        for _ in xrange(nbot):
+            n, = struct.unpack_from('<H', self._map, pos)
+            self.names.append(self._map[pos + 2:pos + 2 + n].decode('utf-8'))
+            pos += 2 + n
+        self._offsets = self._read_index(pos)
+        self.history = History(keyframe_every=self.keyframe_every,
+                               records=self, seed=self.seed)
+
+    def _read_index(self, start):
+        '''the record offsets, from the index if the game finished,
+        otherwise by walking the length prefixes.'''
+        size = len(self._map)
+        if size >= start + TRAILER.size:
+            where, count, magic = TRAILER.unpack_from(self._map,
+                                                      size - TRAILER.size)
+            if magic == INDEX_MAGIC:
+                return np.frombuffer(self._map, dtype='<u8', count=count,
+                                     offset=where).tolist()
+        offsets, pos = [], start
+        while pos + LENGTH.size <= size:
+            n, = LENGTH.unpack_from(self._map, pos)
+            if pos + LENGTH.size + n > size: #cut off mid-record
+                break
+            offsets.append(pos)
+            pos += LENGTH.size + n
+        return offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def record(self, turn):
+        '''decode the record for one turn.'''
+        pos = self._offsets[turn]
+        n, = LENGTH.unpack_from(self._map, pos)
+        return decode_record(self._map[pos + LENGTH.size:
+                                       pos + LENGTH.size + n], self.version)
+
+    def __getitem__(self, turn):
+        '''a record, or a list of them for a slice (which is what
+        History needs from its records).'''
+        if isinstance(turn, slice):
+            return [self.record(t) for t in xrange(*turn.indices(len(self)))]
+        return self.record(turn)
+
+    def __iter__(self):
+        for turn in xrange(len(self)):
+            yield self.record(turn)
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+'''tournaments: rather than every bot playing in every game, games are
+played between small groups of bots, round after round, and rounds stop
+being scheduled once the ranking is settled.
+
+a bot's rating is its mean score (turns survived) per game, with a
+confidence interval of z standard errors either side. a bot is settled
+once it has played min_games and its interval is clear of the intervals
+of the bots ranked either side of it, or is narrower than precision
+either side (bots which really are tied never separate); each round
+only schedules games
+for bots which aren't settled yet (filling any group that comes up
+short with their nearest-ranked rivals), and the tournament is over
+when every bot is settled, or after max_rounds.
+
+groups are picked by mode:
+    swiss: bots of about the same rank play each other (the first round
+           is random)
+    groups: the unsettled bots are snake-seeded into groups, so every
+            group gets a spread of strengths
+    roundrobin: every group of size of the unsettled bots plays (so a
+                round can be a lot of games, unless size is 2)
+
+Call with "$ python tournament.py <botdir>", or with -h for the rest of
+the options.'''
+
+import itertools
+import math
+import random
+
+MODES = ['swiss', 'groups', 'roundrobin']
+
+
+class Tournament(object):
+    '''runs a tournament with a Controller's bots. all the games are
+    played through the Controller, so its scores (and everything else
+    it keeps track of) cover every game of the tournament.'''
+    def __init__(self, controller, mode='swiss', size=4, z=1.96,
+                 min_games=5, precision=2., seed=None):
+        if mode not in MODES:
+            raise ValueError('no such tournament mode: %s' % mode)
+        self.controller = controller
+        self.mode = mode
+        self.size = min(size, len(controller.bots))
+        self.z = z
+        self.min_games = min_games
+        self.precision = precision
+        self.rng = random.Random(seed)
+        self.names = [bot.name for bot in controller.bots]
+        self.rounds = 0
+
+    def standings(self):
+        '''(name, games, mean, low, high) for every bot, best first.
+        bots with no games yet come last, in random order.'''
+        rows = []
+        for name in self.names:
+            scores = self.controller.scores[name]
+            n = len(scores)
+            if n == 0:
+                rows.append((name, 0, None, None, None))
+                continue
+            mean = sum(scores) / float(n)
+            if n > 1:
+                var = sum((s - mean) ** 2 for s in scores) / (n - 1)
+                half = self.z * math.sqrt(var / n)
+            else:
+                half = float('inf')
+            rows.append((name, n, mean, mean - half, mean + half))
+        self.rng.shuffle(rows)
+        return sorted(rows, key=lambda row: (row[1] == 0, -(row[2] or 0)))
+
+    def unsettled(self, standings=None):
+        '''the names of the bots which need more games, best first.'''
+        standings = standings or self.standings()
+        need = []
+        for i, (name, n, mean, low, high) in enumerate(standings):
+            if n < self.min_games:
+                need.append(name)
+                continue
+            if high - mean <= self.precision:
+                continue
+            above = standings[i - 1] if i > 0 else None
+            below = standings[i + 1] if i + 1 < len(standings) else None
+            if ((above is not None and (above[3] is None or
+                                        above[3] <= high)) or
+                    (below is not None and (below[4] is None or
+                                            below[4] >= low))):
+                need.append(name)
+        return need
+
+    def schedule(self):
+        '''the fields (lists of bot names) for the next round; empty
+        once the ranking is settled.'''
+        standings = self.standings()
+        ranked = [row[0] for row in standings]
+        need = self.unsettled(standings)
+        if not need:
+            return []
+        if self.mode == 'swiss':
+            #windows of neighbouring ranks, covering everyone who needs a
+            #game
+            fields, covered = [], set()
+            for name in need:
+                if name in covered:
+                    continue
+                start = min(ranked.index(name), len(ranked) - self.size)
+                field = ranked[start:start + self.size]
+                covered.update(field)
+                fields.append(field)
+            return fields
+        if self.mode == 'groups':
+            ngroup = -(-len(need) // self.size)
+            fields = [[] for _ in xrange(ngroup)]
+            for i, name in enumerate(need):
+                lap, j = divmod(i, ngroup)
+                fields[j if lap % 2 == 0 else ngroup - 1 - j].append(name)
+        else:
+            fields = [list(field) for field in
+                      itertools.combinations(need, min(self.size,
+                                                       len(need)))]
+        return [self._fill(field, ranked) for field in fields]
+
+    def _fill(self, field, ranked):
+        '''top a field up to size with the bots ranked nearest to it.'''
+        middle = sum(ranked.index(name) for name in field) / len(field)
+        others = sorted((name for name in ranked if name not in field),
+                        key=lambda name: abs(ranked.index(name) - middle))
+        return field + others[:self.size - len(field)]
+
+    def play(self, max_rounds=100, jobs=1):
+        '''play rounds until the ranking settles (or max_rounds);
+        returns how many rounds that took.'''
+        for _ in xrange(max_rounds):
+            fields = self.schedule()
+            if not fields:
+                break
+            self.controller.run(fields=fields, jobs=jobs)
+            self.rounds += 1
+        return self.rounds
+
+    def leaderboard(self):
+        '''an ok-formatted table of the standings'''
+        need = set(self.unsettled())
+        rows = []
+        for name, n, mean, low, high in self.standings():
+            if n == 0:
+                rows.append('{:20} -> no games'.format(name))
+                continue
+            rows.append('{:20} -> {:7.1f} ({:7.1f} - {:7.1f}) in {:d} games{}'
+                        .format(name, mean, max(low, 0), high, n,
+                                ' *' if name in need else ''))
+        return '\n'.join(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    from abotcalypse import Controller
+
+    parser = argparse.ArgumentParser(description='Run an ABOTCALYPSE '
+                                                 'tournament')
+    parser.add_argument('botdir', nargs='?', default='bots/')
+    parser.add_argument('-m', '--mode', choices=MODES, default='swiss')
+    parser.add_argument('-s', '--size', type=int, default=4,
+                        help='bots per game')
+    parser.add_argument('--rounds', type=int, default=100,
+                        help='the most rounds to play')
+    parser.add_argument('--min-games', type=int, default=5)
+    parser.add_argument('-z', type=float, default=1.96,
+                        help='confidence interval, in standard errors')
+    parser.add_argument('--precision', type=float, default=2.,
+                        help='confidence interval (either side, in turns) '
+                             'narrow enough to call a tie')
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('-t', '--timeout', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+
+    args = parser.parse_args()
+    controller = Controller(args.botdir, timeout=args.timeout,
+                            seed=args.seed)
+    tournament = Tournament(controller, args.mode, args.size, args.z,
+                            args.min_games, args.precision, args.seed)
+    rounds = tournament.play(args.rounds, args.jobs)
+    print 'Played {:d} rounds ({}settled)'.format(rounds,
+        'not ' if tournament.unsettled() else '')
+    print tournament.leaderboard()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+'''straight-line paths for things flying over the board: thrown rocks
+and meteors. paths are worked out up front as arrays of cells, so
+finding where a thrown rock lands is one lookup into the board grid
+rather than a python loop over every square it passes.'''
+
+from math import sin, cos, radians
+
+import numpy as np
+
+_drops = {}
+_falls = {}
+FALLS_KEPT = 2048 #meteor paths cached, at most
+
+
+def _drop(y0, dy, n):
+    '''the heights a thrown rock passes through, one per step in x:
+    y0, then int(y - dy) from each to the next (truncating towards
+    zero, like the rules say). cached, since throws from the same
+    height at the same slope come up again and again.'''
+    ys = _drops.get((y0, dy))
+    if ys is None or len(ys) < n:
+        ys, y = [], y0
+        for _ in xrange(n):
+            ys.append(y)
+            y = int(y - dy)
+        ys = _drops[y0, dy] = np.array(ys)
+    return ys[:n]
+
+
+def throw_path(x0, y0, dx, dy, width, height):
+    '''the cells a rock thrown from (x0, y0) goes through, moving dx
+    (+-1) in x and dropping dy each step, up to and including the first
+    one off the side of the board.'''
+    n = width - x0 + 1 if dx > 0 else x0 + 2
+    n = max(n, 1)
+    xs = x0 + dx * np.arange(n)
+    return xs, _drop(y0, dy, n)
+
+
+def meteor_path(x0, y0, vx, vy, steps):
+    '''the cells a meteor passes through, one per step, starting at
+    (x0, y0) and moving (vx, vy) each step. positions are summed step
+    by step (as itertools.count would) and truncated towards zero.'''
+    xs = np.empty(steps)
+    ys = np.empty(steps)
+    xs[0], xs[1:] = x0, vx
+    ys[0], ys[1:] = y0, vy
+    return (np.add.accumulate(xs).astype(int),
+            np.add.accumulate(ys).astype(int))
+
+
+def fall_path(x0, y0, angle, steps):
+    '''the path (xs, ys) of a meteor setting off from (x0, y0) at angle
+    degrees, at a speed of 2, for at least steps steps. since the path
+    only depends on where and how a meteor set off, that's all a replay
+    needs to keep; paths are cached, as they're looked up again every
+    turn a meteor is shown.'''
+    path = _falls.get((x0, y0, angle))
+    if path is None or len(path[0]) < steps:
+        if len(_falls) >= FALLS_KEPT:
+            _falls.clear()
+        theta = radians(angle)
+        path = _falls[x0, y0, angle] = meteor_path(x0, y0, 2 * cos(theta),
+                                                   2 * sin(theta), steps)
+    return path
+
+
+def first_hit(grid, xs, ys, mask=0xff):
+    '''the index of the first cell on a path which is off the grid or
+    has something in it (any of the bits in mask); len(xs) if there
+    isn't one.'''
+    height, width = grid.shape
+    off = (xs < 0) | (xs >= width) | (ys < 0) | (ys >= height)
+    end = int(np.argmax(off)) if off.any() else len(xs)
+    hits = np.flatnonzero(grid[ys[:end], xs[:end]] & mask)
+    return int(hits[0]) if len(hits) else end